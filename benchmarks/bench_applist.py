@@ -0,0 +1,98 @@
+"""Peak memory benchmark for loading the steam app list into an empty database.
+
+Compares parsing the whole GetAppList body at once with json.loads against streaming it through
+AppListParser a chunk at a time. Each way runs in its own process, so the peak RSS is its own. Both
+include the in-memory name indexes, which grow with the catalog either way. Uses a synthetic app list
+by default, or a saved GetAppList response with --app-list.
+
+    py benchmarks/bench_applist.py
+    py benchmarks/bench_applist.py --size 500000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bench_search import synthetic_names  # noqa: E402
+
+MODES = {
+    "baseline": "Imports and an empty database, nothing loaded",
+    "full": "json.loads of the whole body, then add_games",
+    "stream": "AppListParser and add_games a chunk at a time",
+}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux, and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load(mode: str, app_list: str, db_path: str) -> dict[str, float]:
+    from orm import SteamMetaData, init_database
+    from steamapi import AppListParser
+
+    init_database(db_path)
+    start = time.perf_counter()
+    if mode == "full":
+        with open(app_list, "rb") as f:
+            apps = json.loads(f.read())["applist"]["apps"]
+        SteamMetaData.add_games(apps)
+    elif mode == "stream":
+        # The same as SteamAPI.get_app_list_chunks, reading from the file instead of the network
+        parser = AppListParser()
+        chunk = []
+        with open(app_list, "rb") as f:
+            while data := f.read(64 * 1024):
+                chunk += parser.feed(data)
+                if len(chunk) >= 50000:
+                    SteamMetaData.add_games(chunk)
+                    chunk = []
+        SteamMetaData.add_games(chunk)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-list", help="A saved ISteamApps/GetAppList/v2 response")
+    parser.add_argument("--size", type=int, default=250_000, help="Synthetic app list size")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(load(args.mode, args.app_list, args.db)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_list = args.app_list
+        if not app_list:
+            app_list = os.path.join(tmp, "applist.json")
+            apps = [{"appid": i, "name": name} for i, name in enumerate(synthetic_names(args.size), start=1)]
+            with open(app_list, "w", encoding="utf-8") as f:
+                json.dump({"applist": {"apps": apps}}, f)
+            del apps
+        print(f"App list: {os.path.getsize(app_list) / 1024 / 1024:.1f} MB")
+
+        print(f"{'mode':<10}{'peak RSS MB':>14}{'seconds':>10}  ")
+        for mode, description in MODES.items():
+            db_path = os.path.join(tmp, f"{mode}.sqlite")
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--app-list", app_list, "--db", db_path],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(f"{mode:<10}{result['peak_rss_mb']:>14.1f}{result['seconds']:>10.2f}  {description}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Latency and query count benchmark for the command hot paths, with baselines to diff between versions.
+
+Builds a synthetic guild in a fresh database: a full-size app catalog, and members with libraries of
+10 to 5,000 games drawn from it. Then times what each command does once it has parsed its arguments:
+
+    suggest     ServerCog.suggest_game for groups of 2 to 10 members
+    add         UserCog.find_games and Player.add_games, as $add does after match_games
+    link        LibrarySync.apply for libraries of different sizes, Steam lookups faked
+    list        GamePages opening a library and flipping to a random page, as $list does
+    add_games   SteamMetaData.add_games with a batch of new apps on top of the catalog
+
+Every case reports latency percentiles and the sql statements run per call, on this thread and the
+database thread. sqlite counts every row of an executemany as a statement, so bulk inserts show one per
+row. --save writes the results as json, and --compare diffs a run against saved results:
+
+    py benchmarks/bench_commands.py --save before.json
+    py benchmarks/bench_commands.py --compare before.json
+    py benchmarks/bench_commands.py --members 50000 --catalog 250000 --save full.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bench_search import synthetic_names, typo  # noqa: E402
+
+LIBRARY_SIZES = (10, 100, 1000, 5000)
+GROUP_SIZES = (2, 5, 10)
+# Compared against a baseline, a case has regressed when its p50 is this much slower
+REGRESSION = 0.2
+
+
+async def statements(executor) -> int:
+    """Statements run so far here and on the database thread. Pony keeps one connection per thread."""
+    from orm import query_count
+
+    return query_count() + await executor.run(query_count)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(samples)}
+
+
+async def measure(executor, fn, args: list[tuple]) -> dict[str, float]:
+    """Calls `fn` (sync or async) with each of `args`, returning percentiles in ms and statements per call."""
+    before = await statements(executor)
+    samples = []
+    for call_args in args:
+        start = time.perf_counter()
+        result = fn(*call_args)
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append((time.perf_counter() - start) * 1000)
+    run = await statements(executor) - before
+    return {**percentiles(samples), "statements": run / len(args), "calls": len(args)}
+
+
+def build_guild(catalog: list[dict], members: int, rng: random.Random) -> dict[str, list[str]]:
+    """Gives every member a library, log-uniform between the smallest and largest library size."""
+    from orm import Player, db, db_session
+
+    apps = [app for app in catalog if app["name"]]
+    # Most libraries are drawn from the popular end of the catalog, so groups have games in common
+    popular = apps[: max(LIBRARY_SIZES) * 4]
+    libraries = {}
+    for i in range(members):
+        size = int(10 ** rng.uniform(1, 3.7))
+        libraries[str(i)] = list({app["name"] for app in rng.sample(popular, min(size, len(popular)))})
+
+    # The orm adds rows one at a time, which would take longer than the benchmark itself
+    with db_session:
+        connection = db.get_connection()
+        names = {name for library in libraries.values() for name in library}
+        metadata_keys = {}
+        for key, name in connection.execute('SELECT "key", "name" FROM "SteamMetaData"'):
+            metadata_keys.setdefault(name, key)
+        connection.executemany(
+            'INSERT INTO "Game" ("name", "steam_metadata") VALUES (?, ?)',
+            [(name, metadata_keys[name]) for name in names],
+        )
+        game_keys = dict(connection.execute('SELECT "name", "key" FROM "Game"'))
+        connection.executemany(
+            'INSERT INTO "Player" ("id", "name") VALUES (?, ?)', [(id, f"member {id}") for id in libraries]
+        )
+        player_keys = dict(connection.execute('SELECT "id", "key" FROM "Player"'))
+        connection.executemany(
+            f'INSERT INTO "{Player.games.table}" ("game", "player") VALUES (?, ?)',
+            ((game_keys[name], player_keys[id]) for id, library in libraries.items() for name in library),
+        )
+        connection.executemany(
+            f'INSERT INTO "{Player.banned.table}" ("game", "player") VALUES (?, ?)',
+            ((game_keys[name], player_keys[id]) for id, library in libraries.items() for name in library[:3]),
+        )
+        connection.executemany(
+            'UPDATE "Game" SET "player_count" = ? WHERE "name" = ?',
+            [(rng.randint(2, 8), name) for name in rng.sample(sorted(names), len(names) // 10)],
+        )
+    return libraries
+
+
+class FakeSteam:
+    # Store lookups answer straight away, the benchmark is about our side of $link
+    async def get_games_by_ids(self, appids: list[int], progress=None) -> tuple[dict[int, dict], list[int]]:
+        return {appid: {"name": f"Unlisted App {appid}"} for appid in appids}, []
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from cog.server import ServerCog
+    from cog.ui import GamePages
+    from cog.user import UserCog
+    from executor import DatabaseExecutor
+    from library import LibrarySync
+    from orm import Player, SteamMetaData, db_session, init_database, load_name_indexes, load_ownership
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp()
+    init_database(os.path.join(tmp, "bench.sqlite"))
+    executor = DatabaseExecutor()
+    results = {}
+
+    names = synthetic_names(args.catalog, args.seed)
+    catalog = [{"appid": i, "name": name} for i, name in enumerate(names, start=1)]
+    start = time.perf_counter()
+    SteamMetaData.add_games(catalog)
+    print(f"Catalog of {len(catalog)} apps: {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    libraries = build_guild(catalog, args.members, rng)
+    load_name_indexes()
+    load_ownership()
+    print(f"Guild of {len(libraries)} members: {time.perf_counter() - start:.1f}s")
+    by_size = sorted(libraries, key=lambda id: len(libraries[id]))
+
+    server = ServerCog(SimpleNamespace(_ignore_banlist=False, _MEMBER_IGNORE_LIST=[]))
+    for size in GROUP_SIZES:
+        groups = [(rng.sample(by_size, size), rng.randint(1, size)) for _ in range(args.queries)]
+        results[f"suggest/{size} members"] = await measure(executor, server.suggest_game, groups)
+
+    user = UserCog(None)
+    owned = sorted({name for library in libraries.values() for name in library})
+    cases = {
+        "exact": lambda name: name,
+        "typo": lambda name: typo(name, rng),
+        "partial": lambda name: name[: max(3, len(name) // 2)],
+    }
+    for case, make in cases.items():
+        batches = [([make(rng.choice(owned)) for _ in range(3)],) for _ in range(args.queries)]
+        results[f"add/find_games {case}"] = await measure(executor, user.find_games, batches)
+
+    @db_session
+    def add_games(id: str, games: list[str]):
+        Player.get(id=id).add_games(*games)
+
+    adds = [(rng.choice(by_size), [rng.choice(owned) for _ in range(3)]) for _ in range(args.queries)]
+    results["add/add_games"] = await measure(executor, add_games, adds)
+
+    libraries_sync = LibrarySync(FakeSteam(), executor)
+    next_appid = len(catalog) + 1
+    for size in LIBRARY_SIZES:
+        calls = []
+        for i in range(max(1, args.queries // size)):
+            # A few apps in every library are missing from the catalog, like delisted games
+            appids = [app["appid"] for app in rng.sample(catalog, size - size // 20)]
+            appids += range(next_appid, next_appid + size // 20)
+            next_appid += size // 20
+            calls.append((f"link {size} {i}", "linker", f"steam {size} {i}", appids, appids))
+        results[f"link/{size} games"] = await measure(executor, libraries_sync.apply, calls)
+
+    biggest = by_size[-len(by_size) // 10 :]
+
+    async def open_list(id: str):
+        pages = GamePages(executor, id)
+        await pages.load()
+        await pages.get(1)
+
+    async def flip(pages: GamePages):
+        await pages.get(rng.randint(1, pages.max_page))
+
+    results["list/open"] = await measure(executor, open_list, [(rng.choice(biggest),) for _ in range(args.queries)])
+    pages = GamePages(executor, biggest[-1])
+    await pages.load()
+    results["list/flip page"] = await measure(executor, flip, [(pages,) for _ in range(args.queries)])
+
+    batches = []
+    for i in range(5):
+        batch = synthetic_names(10_000, args.seed + i + 1)
+        batches.append(([{"appid": next_appid + j, "name": name} for j, name in enumerate(batch)],))
+        next_appid += len(batch)
+    results["add_games/10000 apps"] = await measure(executor, SteamMetaData.add_games, batches)
+
+    executor.close()
+    return {
+        "meta": {
+            "members": args.members,
+            "catalog": args.catalog,
+            "queries": args.queries,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def report(results: dict, baseline: dict = None):
+    print(f"{'case':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'stmts':>9}" + "  change")
+    for case, result in results["results"].items():
+        line = f"{case:<28}" + "".join(f"{result[k]:>10.2f}" for k in ("p50", "p95", "p99", "max"))
+        line += f"{result['statements']:>9.1f}"
+        before = baseline["results"].get(case) if baseline else None
+        if before:
+            change = result["p50"] / before["p50"] - 1 if before["p50"] else 0.0
+            line += f"  {change:+.0%}"
+            if change > REGRESSION:
+                line += " slower"
+            if round(result["statements"]) > round(before["statements"]):
+                line += f" (statements {before['statements']:.1f} -> {result['statements']:.1f})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=1_000)
+    parser.add_argument("--catalog", type=int, default=100_000, help="Synthetic app catalog size")
+    parser.add_argument("--queries", type=int, default=200, help="Calls per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this json file")
+    parser.add_argument("--compare", help="Diff against results saved with --save")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["members"] != args.members or baseline["meta"]["catalog"] != args.catalog:
+            print(f"Warning: the baseline was run with {baseline['meta']}")
+
+    results = asyncio.run(run(args))
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Latency benchmark for the game name indexes used by match_game.
+
+Builds the indexes over a full-size app list and times lookups with exact names, partial names and
+typos. Uses a synthetic catalog by default, or a saved GetAppList response with --app-list.
+
+    py benchmarks/bench_search.py
+    py benchmarks/bench_search.py --app-list applist.json --queries 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from search import NameIndex, TrigramIndex  # noqa: E402
+
+COMMON = "the of a and to in for at space war world dark star legend simulator tales".split()
+SYLLABLES = (
+    "ba be bi bo bu ka ke ki ko ku la le li lo lu ma me mi mo mu ra re ri ro ru sa se si so su ta te ti to tu".split()
+)
+
+
+def synthetic_names(count: int, seed: int = 0) -> list[str]:
+    """Titles built from a large made up vocabulary, with a few very common words mixed in.
+
+    A handful of words repeated everywhere would make every trigram match most of the catalog, which is
+    far worse than the real app list, so most words here are rare like in real titles.
+    """
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(count // 4)]
+    names = []
+    for i in range(count):
+        words = []
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.25:
+                words.append(rng.choice(COMMON))
+            else:
+                words.append(rng.choice(vocabulary))
+        title = " ".join(word.title() for word in words)
+        # Sequels and editions, like the real catalog has plenty of
+        if rng.random() < 0.3:
+            title += f" {rng.randint(2, 5)}"
+        names.append(title)
+    return names
+
+
+def load_names(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return [app["name"] for app in json.load(f)["applist"]["apps"] if app["name"]]
+
+
+def typo(name: str, rng: random.Random) -> str:
+    if len(name) < 4:
+        return name
+    i = rng.randrange(len(name) - 1)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2 :]
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(samples, n=100)
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": max(samples)}
+
+
+def measure(fn, queries: list[str]) -> dict[str, float]:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-list", help="A saved ISteamApps/GetAppList/v2 response")
+    parser.add_argument("--size", type=int, default=250_000, help="Synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    names = load_names(args.app_list) if args.app_list else synthetic_names(args.size, args.seed)
+    rng = random.Random(args.seed)
+    sample = rng.sample(names, min(args.queries, len(names)))
+    print(f"{len(names)} names, {len(sample)} queries per case")
+
+    start = time.perf_counter()
+    names_index = NameIndex()
+    names_index.build(names)
+    print(f"NameIndex build: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    fuzzy_index = TrigramIndex()
+    fuzzy_index.build(names)
+    print(f"TrigramIndex build: {time.perf_counter() - start:.2f}s")
+
+    cases = {
+        "exact": (names_index.exact, [name.upper() for name in sample]),
+        "prefix": (names_index.prefix, [name[: max(3, len(name) // 2)] for name in sample]),
+        "suffix": (names_index.suffix, [name[-max(3, len(name) // 2) :] for name in sample]),
+        "fuzzy typo": (fuzzy_index.search, [typo(name, rng) for name in sample]),
+        "fuzzy partial": (fuzzy_index.search, [name[: max(3, len(name) // 2)] for name in sample]),
+        # What every lookup used to cost, for comparison
+        "full scan": (
+            lambda query: [name for name in names if name.lower().startswith(query.lower())],
+            [name[: max(3, len(name) // 2)] for name in sample[:50]],
+        ),
+    }
+    print(f"{'case':<15}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>10}")
+    for case, (fn, queries) in cases.items():
+        result = measure(fn, queries)
+        print(f"{case:<15}" + "".join(f"{result[k]:>10.0f}" for k in ("p50", "p90", "p99", "max")))
+
+
+if __name__ == "__main__":
+    main()
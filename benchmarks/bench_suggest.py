@@ -0,0 +1,76 @@
+"""Latency benchmark for the ownership index behind $suggest.
+
+Fills the index with a large guild where everyone has a big library, then times suggestions for groups
+of different sizes, next to the set intersection the bot used to do.
+
+    py benchmarks/bench_suggest.py
+    py benchmarks/bench_suggest.py --players 50000 --games 20000 --library 3000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ownership import OwnershipIndex  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=20_000)
+    parser.add_argument("--games", type=int, default=10_000, help="Games across the whole guild")
+    parser.add_argument("--library", type=int, default=1_000, help="Games per player")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [f"Game {i}" for i in range(args.games)]
+    # Everyone has the popular games, so groups actually have something in common
+    popular = names[:50]
+    libraries = {str(i): set(popular + rng.sample(names, args.library)) for i in range(args.players)}
+    bans = {player: set(rng.sample(names, 10)) for player in libraries}
+
+    start = time.perf_counter()
+    index = OwnershipIndex()
+    index.build(
+        ((player, name) for player, games in libraries.items() for name in games),
+        ((player, name) for player, games in bans.items() for name in games),
+        ((name, rng.randint(2, 16)) for name in rng.sample(names, args.games // 10)),
+    )
+    print(f"{args.players} players, {args.library} games each, build: {time.perf_counter() - start:.2f}s")
+
+    players = sorted(libraries)
+    print(f"{'group':>8}{'index p50 us':>15}{'index p99 us':>15}{'cached p50 us':>15}{'sets p50 us':>15}")
+    for group in (2, 10, 100, 1000):
+        groups = [rng.sample(players, group) for _ in range(args.queries)]
+        index_samples = []
+        cached_samples = []
+        set_samples = []
+        for members in groups:
+            start = time.perf_counter()
+            index.suggest(members, 4)
+            index_samples.append((time.perf_counter() - start) * 1e6)
+
+            # The same group asking again, with nothing changed in between
+            start = time.perf_counter()
+            index.suggest(members, 4)
+            cached_samples.append((time.perf_counter() - start) * 1e6)
+
+            # What suggest_game used to do once every player's library was loaded
+            start = time.perf_counter()
+            shared = set.intersection(*(libraries[m] for m in members))
+            shared.difference_update(*(bans[m] for m in members))
+            set_samples.append((time.perf_counter() - start) * 1e6)
+        index_cuts = statistics.quantiles(index_samples, n=100)
+        cached_cuts = statistics.quantiles(cached_samples, n=100)
+        set_cuts = statistics.quantiles(set_samples, n=100)
+        print(f"{group:>8}{index_cuts[49]:>15.0f}{index_cuts[98]:>15.0f}{cached_cuts[49]:>15.0f}{set_cuts[49]:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Replays a recorded gateway trace against the bot, to see how it holds up under real traffic.
+
+Traces are recorded by running the bot with RECORD_TRACE set to a file name (see gateway_trace.py), or
+made up with --generate. The bot and its cogs run against the dpytest backend with a fresh database,
+and every event is fed to the gateway parsers as if discord sent it, at the recorded pace times --speed,
+or as fast as possible with --speed max. $link is skipped, since it would call Steam, and game pickers
+from $add and $ban are answered with their first game straight away, like a member would.
+
+Reports the event throughput, how late the event loop ran (a timer that should fire every 10ms), and
+how many sql statements (and of those, writes) the database thread ran, all over the replay itself. Writing what's still
+buffered afterwards is timed separately.
+
+    py benchmarks/replay_gateway.py --generate trace.jsonl.gz --members 5000 --minutes 10
+    py benchmarks/replay_gateway.py trace.jsonl.gz --speed 10
+    py benchmarks/replay_gateway.py trace.jsonl.gz --speed max
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bench_search import synthetic_names  # noqa: E402
+
+LAG_INTERVAL = 0.01
+STATUSES = ["online", "idle", "dnd", "offline"]
+COMMANDS = ["$suggest *", "$suggest 2", "$suggest General", "$add {game}", "$ban {game}"]
+SKIPPED = ("$link",)
+
+
+def generate(path: str, members: int, minutes: float, rate: float, seed: int):
+    """Writes a made up trace: mostly presence changes, with some voice traffic and commands mixed in."""
+    rng = random.Random(seed)
+    games = synthetic_names(2000, seed)
+    ids = [str(1_000_000 + i) for i in range(members)]
+    channels = [
+        {"id": "1", "type": 0, "name": "general"},
+        {"id": "2", "type": 2, "name": "General"},
+        {"id": "3", "type": 2, "name": "Gaming"},
+    ]
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+
+        def write(t: float, event: str, data: dict):
+            f.write(json.dumps([round(t, 3), event, data], separators=(",", ":")) + "\n")
+
+        users = [{"id": id, "username": f"user{id}", "discriminator": "0", "avatar": None, "bot": False} for id in ids]
+        write(0, "GUILD_CREATE", {"id": "10", "channels": channels, "members": users})
+        t = 0.0
+        message_id = 100
+        while t < minutes * 60:
+            t += rng.expovariate(rate)
+            user = rng.choice(users)
+            roll = rng.random()
+            if roll < 0.8:
+                activities = [{"type": 0, "name": rng.choice(games)}] if rng.random() < 0.5 else []
+                data = {
+                    "user": {"id": user["id"]},
+                    "guild_id": "10",
+                    "status": rng.choice(STATUSES),
+                    "activities": activities,
+                    "client_status": {},
+                }
+                write(t, "PRESENCE_UPDATE", data)
+            elif roll < 0.95:
+                member = {"user": user, "roles": [], "joined_at": None, "deaf": False, "mute": False}
+                data = {
+                    "guild_id": "10",
+                    "channel_id": rng.choice(["2", "3", None]),
+                    "user_id": user["id"],
+                    "member": member,
+                    "session_id": "",
+                    "deaf": False,
+                    "mute": False,
+                    "self_deaf": False,
+                    "self_mute": False,
+                    "self_video": False,
+                    "suppress": False,
+                    "request_to_speak_timestamp": None,
+                }
+                write(t, "VOICE_STATE_UPDATE", data)
+            else:
+                message_id += 1
+                data = {
+                    "id": str(message_id),
+                    "channel_id": "1",
+                    "guild_id": "10",
+                    "author": user,
+                    "member": {"user": user, "roles": [], "joined_at": None, "deaf": False, "mute": False},
+                    "content": rng.choice(COMMANDS).format(game=rng.choice(games)),
+                    "timestamp": "2024-01-01T00:00:00+00:00",
+                    "edited_timestamp": None,
+                    "tts": False,
+                    "mention_everyone": False,
+                    "mentions": [],
+                    "mention_roles": [],
+                    "attachments": [],
+                    "embeds": [],
+                    "pinned": False,
+                    "type": 0,
+                }
+                write(t, "MESSAGE_CREATE", data)
+
+
+def answer_pickers():
+    """Makes every WhichGames picker answer itself with its first game, instead of waiting out its timeout."""
+    from cog import user
+    from cog.ui import WhichGames
+
+    class AnsweredGames(WhichGames):
+        def __init__(self, user_id: int, choices: dict[str, list[str]]):
+            super().__init__(user_id, choices)
+            for dropdown in self.dropdowns:
+                dropdown.selection = dropdown.options[0].label
+                dropdown.disabled = True
+            self.stop()
+
+    user.WhichGames = AnsweredGames
+
+
+class Replay:
+    def __init__(self, bot):
+        from discord.ext.test import backend
+
+        self.bot = bot
+        self.backend = backend
+        self.state = backend.get_state()
+        self.guilds = {}
+        self.counts: dict[str, int] = {}
+
+    def add_members(self, guild, users: list[dict]):
+        for user in users:
+            member = self.backend.make_user(user["username"], "0001", id_num=int(user["id"]))
+            self.backend.make_member(member, guild)
+
+    def handle(self, event: str, data: dict):
+        if event == "GUILD_CREATE":
+            guild = self.guilds[data["id"]] = self.backend.make_guild(f"Guild {data['id']}", id_num=int(data["id"]))
+            for channel in data["channels"]:
+                if channel["type"] == 0:
+                    self.backend.make_text_channel(channel["name"], guild, id_num=int(channel["id"]))
+                elif channel["type"] == 2:
+                    self.backend.make_voice_channel(channel["name"], guild, id_num=int(channel["id"]))
+            self.backend.make_member(self.state.user, guild)
+            self.add_members(guild, data["members"])
+        elif event == "GUILD_MEMBERS_CHUNK":
+            self.add_members(self.guilds[data["guild_id"]], data["members"])
+        elif event == "GUILD_MEMBER_ADD":
+            self.add_members(self.guilds[data["guild_id"]], [data["user"]])
+        elif event == "GUILD_MEMBER_REMOVE":
+            self.state.parse_guild_member_remove(data)
+        elif event == "MESSAGE_CREATE":
+            if data["content"].startswith(SKIPPED) or data["guild_id"] not in self.guilds:
+                return
+            self.state.parse_message_create(data)
+        elif event == "PRESENCE_UPDATE":
+            self.state.parse_presence_update(data)
+        elif event == "VOICE_STATE_UPDATE":
+            self.state.parse_voice_state_update(data)
+        self.counts[event] = self.counts.get(event, 0) + 1
+
+
+async def replay(path: str, speed: float) -> dict:
+    from discord.ext import test
+
+    from gateway_trace import read_trace
+    from main import ServerCog, UserCog, WhatShouldWePlayBot
+    from orm import query_count, write_count
+
+    bot = WhatShouldWePlayBot(os.path.join(tempfile.mkdtemp(), "replay.sqlite"))
+    await bot.add_cog(UserCog(bot))
+    await bot.add_cog(ServerCog(bot))
+    await bot._async_setup_hook()
+    test.configure(bot, guilds=0)
+    bot.presence.start()
+    answer_pickers()
+
+    lags = []
+    running = True
+
+    async def watch_lag():
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append((time.perf_counter() - start - LAG_INTERVAL) * 1000)
+
+    watcher = asyncio.create_task(watch_lag())
+    player = Replay(bot)
+    # All the bot's database work goes through the database thread, and the count is kept per thread
+    statements = await bot.db.run(query_count)
+    writes = await bot.db.run(write_count)
+    started = time.perf_counter()
+    for i, (t, event, data) in enumerate(read_trace(path)):
+        if speed:
+            delay = started + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            player.handle(event, data)
+        except Exception as e:
+            print(f"Skipped {event} at {t}s: {e!r}")
+        # Let the handlers run, and drop the bot's replies so they don't pile up
+        await asyncio.sleep(0)
+        if i % 1000 == 999:
+            await test.empty_queue()
+    await test.run_all_events()
+    replayed = time.perf_counter() - started
+    statements = await bot.db.run(query_count) - statements
+    writes = await bot.db.run(write_count) - writes
+    running = False
+
+    # Whatever the presence buffer is still holding, which the replay window doesn't count
+    started = time.perf_counter()
+    await bot.presence.close()
+    drained = time.perf_counter() - started
+    await watcher
+    bot.db.close()
+
+    events = sum(player.counts.values())
+    cuts = statistics.quantiles(lags, n=100, method="inclusive") if len(lags) > 1 else lags * 99
+    return {
+        "events": player.counts,
+        "seconds": replayed,
+        "drain_seconds": drained,
+        "events_per_second": events / replayed,
+        "loop_lag_ms": {"p50": cuts[49], "p99": cuts[98], "max": max(lags)},
+        "db_statements": statements,
+        "db_statements_per_second": statements / replayed,
+        "db_writes": writes,
+        "db_writes_per_second": writes / replayed,
+        "db": bot.db.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", nargs="?", help="A trace recorded with RECORD_TRACE")
+    parser.add_argument("--speed", default="1", help="1, 10 or any other multiple of the recorded pace, or max")
+    parser.add_argument("--generate", metavar="PATH", help="Write a made up trace here instead of replaying")
+    parser.add_argument("--members", type=int, default=1000, help="Members in a generated trace")
+    parser.add_argument("--minutes", type=float, default=5, help="Length of a generated trace")
+    parser.add_argument("--rate", type=float, default=20, help="Events per second in a generated trace")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.generate, args.members, args.minutes, args.rate, args.seed)
+        print(f"Wrote {args.generate} ({os.path.getsize(args.generate) / 1024:.0f} KB)")
+        return
+    if not args.trace:
+        parser.error("a trace to replay is needed, or --generate")
+
+    speed = 0 if args.speed == "max" else float(args.speed)
+    result = asyncio.run(replay(args.trace, speed))
+    print(f"Replayed {sum(result['events'].values())} events in {result['seconds']:.1f}s")
+    for event, count in sorted(result["events"].items()):
+        print(f"  {event:<22}{count:>8}")
+    print(f"Throughput:      {result['events_per_second']:.0f} events/s")
+    lag = result["loop_lag_ms"]
+    print(f"Event loop lag:  p50 {lag['p50']:.1f}ms, p99 {lag['p99']:.1f}ms, max {lag['max']:.1f}ms")
+    # sqlite counts every row of an executemany as a statement
+    print(f"Database statements: {result['db_statements']} ({result['db_statements_per_second']:.1f}/s)")
+    print(f"Database writes:     {result['db_writes']} ({result['db_writes_per_second']:.1f}/s)")
+    print(f"Final presence flush: {result['drain_seconds'] * 1000:.0f}ms")
+    db = result["db"]
+    print(f"Database queue:  {db['calls']} calls, {db['wait_avg'] * 1000:.1f}ms average wait")
+
+
+if __name__ == "__main__":
+    main()
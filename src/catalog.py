@@ -0,0 +1,70 @@
+import logging
+import time
+
+from discord.ext import tasks
+
+from executor import DatabaseExecutor
+from orm import Setting, SteamMetaData
+from steamapi import SteamAPI, SteamAPIError
+
+
+class CatalogSync:
+    """Keeps the local SteamMetaData snapshot in step with steam's app catalog.
+
+    The time of the last successful sync is stored in the database, so a restart only asks steam for
+    the apps that changed since then (or nothing at all, if the snapshot is still fresh).
+    """
+
+    LAST_SYNCED = "catalog.last_synced"
+
+    def __init__(self, api: SteamAPI, db: DatabaseExecutor, interval: float = 6 * 60 * 60):
+        self.api = api
+        self.db = db
+        self.interval = interval
+        self._task = tasks.loop(seconds=interval)(self._scheduled)
+
+    async def last_synced(self) -> int:
+        return int(await self.db.run(Setting.get_value, self.LAST_SYNCED, "0"))
+
+    async def sync(self, force: bool = False) -> int:
+        """Pulls in the apps that changed since the last sync. Returns the number of apps seen."""
+        last_synced = await self.last_synced()
+        started = int(time.time())
+        if not force and started - last_synced < self.interval:
+            logging.info("Steam catalog is up to date, skipping sync")
+            return 0
+
+        count = 0
+        try:
+            if self.api.API_KEY:
+                async for apps in self.api.get_app_list_pages(if_modified_since=last_synced):
+                    await self.db.run(SteamMetaData.add_games, apps)
+                    count += len(apps)
+                    logging.info(f"Steam catalog sync: {count} apps so far")
+            else:
+                # The incremental endpoint needs a key, without one all we can do is grab everything.
+                # It's parsed as it downloads and added a chunk at a time, so it's never all in memory.
+                async for apps in self.api.get_app_list_chunks():
+                    await self.db.run(SteamMetaData.add_games, apps)
+                    count += len(apps)
+                    logging.info(f"Steam catalog sync: {count} apps so far")
+        except SteamAPIError as e:
+            # Whatever made it in is kept, but the marker stays put so the next sync covers the gap
+            logging.warning(f"Steam catalog sync incomplete after {count} apps: {e}")
+            return count
+
+        # Use the start time, so anything that changed while we were syncing is picked up next time
+        await self.db.run(Setting.set_value, self.LAST_SYNCED, str(started))
+        logging.info(f"Synced {count} apps from the steam catalog in {time.time() - started:.1f}s")
+        return count
+
+    async def _scheduled(self):
+        # The first run happens as soon as the task starts, which we only want if the snapshot is stale
+        await self.sync(force=self._task.current_loop > 0)
+
+    def start(self):
+        if not self._task.is_running():
+            self._task.start()
+
+    def stop(self):
+        self._task.cancel()
@@ -1,9 +1,11 @@
 # A discord bot cog that manages server metadata
-from typing import List, Optional, Set
+from typing import List, Optional
 import discord
 from discord.ext import commands
-from orm import db_session, Game, Player
-from pony.orm import select, coalesce
+from orm import db_session, Game
+from metrics import metrics
+from ownership import ownership
+from presence import PresenceIndex
 from cog.converter import GamePlayerCount
 import random
 
@@ -11,6 +13,7 @@ import random
 class ServerCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.presence = PresenceIndex(bot._MEMBER_IGNORE_LIST)
 
     @commands.command()
     async def suggest(self, ctx: commands.Context, filter: Optional[str] = None):
@@ -18,19 +21,21 @@ class ServerCog(commands.Cog):
         if not ctx.guild:
             await ctx.send("This command is only available in servers.")
             return
-        all_games = self.get_games_guild(ctx.guild)
         if filter is None or filter == "*":
-            member_count = len(ctx.guild.members)
+            member_ids = self.presence.online(ctx.guild)
+            member_count = ctx.guild.member_count
         elif filter.isdigit():
+            member_ids = self.presence.online(ctx.guild)
             member_count = int(filter)
         else:
-            for channel in ctx.guild.voice_channels:
-                if filter == channel.name:
-                    member_count = len(channel.members)
-            else:
+            channel = discord.utils.get(ctx.guild.voice_channels, name=filter)
+            if channel is None:
                 await ctx.send("Selected channel is not a voice channel or spelled incorrectly. Try again.")
                 return
-        games = self.suggest_game(ctx.guild, all_games, member_count)
+            # Everyone in the channel is playing, whether they show as online or not
+            member_ids = self.presence.in_channel(ctx.guild, channel.id)
+            member_count = len(member_ids)
+        games = self.suggest_game([str(id) for id in member_ids], member_count)
         if games:
             await ctx.send(", ".join(games))
         else:
@@ -48,23 +53,32 @@ class ServerCog(commands.Cog):
         """Set the player count for a game"""
         name = config.game
         players = config.players
-        with db_session:
+
+        @db_session
+        def set_player_count(name: str, players: int) -> bool:
             game = Game.get(name=name) or Game(name=name)  # TODO: Limit to guild managed games
             if game is None:
-                await ctx.message.add_reaction("👎")
-                await ctx.send("Game not found.")
-                return
-
+                return False
             game.set_player_count(players)
+            return True
+
+        if not await self.bot.db.run(set_player_count, name, players):
+            await ctx.message.add_reaction("👎")
+            await ctx.send("Game not found.")
+            return
         await ctx.message.add_reaction("👍")
 
     @admin.command()
     # @commands.has_permissions(administrator=True) # TODO: Add permission check
     async def list(self, ctx: commands.Context):
         """List all games"""
-        with db_session:
+
+        @db_session
+        def get_games() -> list[str]:
             games = Game.select()  # TODO Limit to guild managed games
-            games = [game.name for game in games]
+            return [game.name for game in games]
+
+        games = await self.bot.db.run(get_games)
         await ctx.send(f"Games: {', '.join(games)}")
 
     @admin.command()
@@ -76,35 +90,94 @@ class ServerCog(commands.Cog):
         self.bot._ignore_banlist = ignore
         await ctx.message.add_reaction("👍")
 
-    @db_session
-    def get_games_guild(self, guild: discord.Guild) -> List[Set[str]]:
-        """Returns a list, where each element is a set of games that a user in the guild has."""
-        game_data = []
-        for member in guild.members:
-            if member.id not in self.bot._MEMBER_IGNORE_LIST and member.status == discord.Status.online:
-                player = Player.get(id=str(member.id)) or Player(id=str(member.id), name=member.name)
-                game_data.append(set([game.name for game in player.get_games()]))
-        return game_data
-
-    def suggest_game(self, guild: discord.Guild, game_data: List[Set[str]], player_count: int) -> Optional[str]:
-        if not game_data:
-            return None
+    @admin.command()
+    # @commands.has_permissions(administrator=True) # TODO: Add permission check
+    async def stats(self, ctx: commands.Context):
+        """Show how long commands, steam and the database are taking"""
+        await ctx.send(f"```\n{self.format_stats()}\n```")
 
-        games = set.intersection(*game_data)
-        bans = self.get_guild_bans(guild)
+    @admin.group(invoke_without_command=True)
+    @commands.has_permissions(administrator=True)
+    async def profile(self, ctx: commands.Context):
+        """Show what's being profiled"""
+        targets = self.bot.profiler.targets
+        await ctx.send(f"Profiling {', '.join(targets)}." if targets else "Nothing is being profiled.")
+
+    @profile.command(name="on")
+    @commands.has_permissions(administrator=True)
+    async def profile_on(self, ctx: commands.Context, *, target: str):
+        """Profile a command or event listener (like presence_update) every time it runs"""
+        if not self.bot.profiler.enable(target):
+            await ctx.send(f"There's no command or listener called {target}.")
+            return
+        await ctx.send(f"Profiling {target}, reports go to {self.bot.profiler.directory}/.")
+
+    @profile.command(name="off")
+    @commands.has_permissions(administrator=True)
+    async def profile_off(self, ctx: commands.Context, *, target: Optional[str] = None):
+        """Stop profiling a command or listener, or everything"""
+        self.bot.profiler.disable(target)
+        await ctx.message.add_reaction("👍")
+
+    @profile.command(name="last")
+    @commands.has_permissions(administrator=True)
+    async def profile_last(self, ctx: commands.Context):
+        """Show the summary of the last profiled run"""
+        report = self.bot.profiler.last_report
+        await ctx.send(f"```\n{report[:1900]}\n```" if report else "Nothing has been profiled yet.")
+
+    def format_stats(self, limit: int = 8) -> str:
+        lines = []
+        for title, name in (("Commands", "command"), ("Steam", "steam_request"), ("Database", "db_call")):
+            rows = metrics.summary(name, limit)
+            if not rows:
+                continue
+            lines.append(f"{title:<34}{'calls':>7}{'p50':>9}{'p99':>9}")
+            for label, calls, p50, p99 in rows:
+                lines.append(f"  {label[:32]:<32}{calls:>7}{p50 * 1000:>7.0f}ms{p99 * 1000:>7.0f}ms")
+        for name, values in metrics.gauges().items():
+            lines.append(f"{name}: " + ", ".join(f"{key} {value:g}" for key, value in values.items()))
+        return "\n".join(lines)
+
+    @commands.Cog.listener()
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        if before.status != after.status:
+            self.presence.update_status(after)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.presence.update_status(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.presence.remove_member(member)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(
+        self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState
+    ):
+        if before.channel != after.channel:
+            self.presence.update_voice(member, before.channel, after.channel)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.presence.remove_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        # After a reconnect that couldn't resume the guild comes back without the presence updates we missed,
+        # so it's loaded again from its members the next time it's needed
+        self.presence.remove_guild(guild)
+
+    def suggest_game(self, member_ids: List[str], player_count: int) -> Optional[List[str]]:
+        if not member_ids:
+            return None
 
         # Filters the games to only those that meet the following criteria:
-        # 1. The game in the table is in the list of possible games
+        # 1. Every one of the members has the game
         # 2. The player count is greater than or equal to the player count requested
-        # 3. The game is not in the ban list (or the bot is ignoring the ban list)
-        with db_session:
-            subquery = select(g for g in Game).filter(
-                lambda g: g.name in games
-                and coalesce(g.player_count, player_count) >= player_count
-                and (g.name not in bans or self.bot._ignore_banlist)
-            )
-
-            games = list(select(g.name for g in subquery)[:])
+        # 3. None of the members banned the game (or the bot is ignoring the ban list)
+        games = ownership.suggest(set(member_ids), player_count, ignore_bans=self.bot._ignore_banlist)
 
         # This is checking to see if there are any games in the list because
         # random.choice breaks if you give it an empty list.
@@ -116,12 +189,3 @@ class ServerCog(commands.Cog):
                 return random.sample(games, suggest_count)
             else:
                 return games
-
-    @db_session
-    def get_guild_bans(self, guild: discord.Guild) -> List[str]:
-        disallowlist = []
-        for member in guild.members:
-            if member.id not in self.bot._MEMBER_IGNORE_LIST and member.status == discord.Status.online:
-                player = Player.get(id=str(member.id)) or Player(id=str(member.id), name=member.name)
-                disallowlist += [game.name for game in player.get_banned_games()]
-        return disallowlist
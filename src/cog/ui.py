@@ -1,6 +1,11 @@
+from collections import OrderedDict
+
 import discord
 from discord.ui import View, Button, Modal, TextInput, Select, button, select
 
+from executor import DatabaseExecutor
+from orm import Player
+
 
 class _JumpToPageModal(Modal):
     def __init__(self, parent: "GameView"):
@@ -12,38 +17,90 @@ class _JumpToPageModal(Modal):
     async def on_submit(self, interaction: discord.Interaction):
         if interaction.user.id != self.parent.user_id:
             await self.parent.update_message(interaction, self.parent.current_page)
+            return
 
         try:
-            page_number = min(
-                int(self.page_input.value),
-                self.parent.max_ban_page if self.parent.view_bans else self.parent.max_game_page,
-            )
+            page_number = min(max(int(self.page_input.value), 1), self.parent.pages.max_page)
         except ValueError:
             await self.parent.update_message(interaction, self.parent.current_page)
+            return
 
         await self.parent.update_message(interaction, page_number)
 
 
+class GamePages:
+    """A player's games or banned games, read from the database a page at a time.
+
+    The pages either side of the one asked for are read with it, so flipping through is instant, and only
+    a few pages are ever kept however many games the player has.
+    """
+
+    PAGE_SIZE = 10
+    # Pages either side of the requested one that are read along with it
+    NEIGHBOURS = 1
+    # Pages kept around, least recently used go first
+    CACHE_SIZE = 6
+
+    def __init__(self, db: DatabaseExecutor, player_id: str, banned: bool = False):
+        self.db = db
+        self.player_id = player_id
+        self.banned = banned
+        self.count = 0
+        self._pages: OrderedDict[int, list[str]] = OrderedDict()
+
+    @property
+    def max_page(self) -> int:
+        return max(1, -(-self.count // self.PAGE_SIZE))
+
+    async def load(self):
+        self.count = await self.db.run(Player.count_games, self.player_id, self.banned)
+        self._pages.clear()
+
+    async def get(self, page: int) -> list[str]:
+        """Returns the rows for a page, counting from 1, padded and trimmed for display."""
+        if page not in self._pages:
+            first = max(1, page - self.NEIGHBOURS)
+            last = min(self.max_page, page + self.NEIGHBOURS)
+            names = await self.db.run(
+                Player.get_game_names,
+                self.player_id,
+                (first - 1) * self.PAGE_SIZE,
+                last * self.PAGE_SIZE,
+                self.banned,
+            )
+            for i in range(first, last + 1):
+                start = (i - first) * self.PAGE_SIZE
+                self._pages[i] = GameView.pad_str(names[start : start + self.PAGE_SIZE])
+            while len(self._pages) > self.CACHE_SIZE:
+                self._pages.popitem(last=False)
+        self._pages.move_to_end(page)
+        return self._pages[page]
+
+
 class GameView(View):
-    def __init__(self, user_id: int, games: list[str], bans: list[str], view_bans: bool = False):
+    def __init__(self, user_id: int, games: GamePages, bans: GamePages, view_bans: bool = False):
         super().__init__()
         self.user_id = user_id
         self.current_page = 1
-        self.max_ban_page = len(bans) // 10
-        self.max_game_page = len(games) // 10
-        self.games = GameView.pad_str(games)
-        self.bans = GameView.pad_str(bans)
+        self.games = games
+        self.bans = bans
         self.view_bans = view_bans
-        self.update_page_lock()
+        self.rows = []
+
+    @property
+    def pages(self) -> GamePages:
+        return self.bans if self.view_bans else self.games
 
-    def get_chunk(arr: list[any], index: int, chunk_size: int = 10):
-        start = index * chunk_size
-        end = start + chunk_size
-        chunk = arr[start:end]
-        while len(chunk) < chunk_size:
-            chunk.append(" " * 40)
+    async def load(self):
+        """Counts the games and reads the first page, call before the first embed."""
+        await self.games.load()
+        await self.bans.load()
+        await self.show(1)
 
-        return chunk
+    async def show(self, page_number: int):
+        self.current_page = page_number
+        self.rows = await self.pages.get(page_number)
+        self.update_page_lock()
 
     def pad_str(strings: list[str]):
         if not strings:
@@ -63,29 +120,24 @@ class GameView(View):
         embed = discord.Embed(title="Your Games Registered with me!")
 
         if self.view_bans:
-            games = self.bans
             name = "Your Banned Games"
         else:
-            games = self.games
             name = "Your Games"
 
-        games = "\n".join(GameView.get_chunk(games, self.current_page))
+        rows = self.rows + [" " * 40] * (GamePages.PAGE_SIZE - len(self.rows))
+        games = "\n".join(rows)
         games = f"```\n{games}```"
 
         embed.add_field(name=name, value=games, inline=True)
-        embed.set_footer(text=f"Page {self.current_page}")
+        embed.set_footer(text=f"Page {self.current_page}/{self.pages.max_page}")
         return embed
 
     def update_page_lock(self):
         self.previous_page.disabled = self.current_page == 1
-        if self.view_bans:
-            self.next_page.disabled = self.current_page >= self.max_ban_page
-        else:
-            self.next_page.disabled = self.current_page >= self.max_game_page
+        self.next_page.disabled = self.current_page >= self.pages.max_page
 
     async def update_message(self, interaction, page_number):
-        self.current_page = page_number
-        self.update_page_lock()
+        await self.show(page_number)
         await interaction.response.edit_message(embed=self.embed(), view=self)
 
     @button(label="⬅️ Previous", style=discord.ButtonStyle.primary)
@@ -129,27 +181,43 @@ class GameView(View):
         await self.update_message(interaction, self.current_page + 1)
 
 
-class WhichGame(View):
-    def __init__(self, user_id: int, user_input: str, *games: list[str]):
+class WhichGames(View):
+    # Every dropdown takes a row, and a message can only have five
+    MAX_DROPDOWNS = 5
+    # Discord allows 25 options in a dropdown, and two of them are "None of These" and "Add Game"
+    MAX_CHOICES = 23
+
+    def __init__(self, user_id: int, choices: dict[str, list[str]]):
         super().__init__()
-        self.games = games
-        self.user_input = user_input
         self.user_id = user_id
-        self.selection = None
-        self.add_item(Dropdown(user_id, user_input, games))
+        self.dropdowns = [Dropdown(user_id, user_input, games) for user_input, games in choices.items()]
+        for dropdown in self.dropdowns:
+            self.add_item(dropdown)
+
+    @property
+    def selections(self) -> dict[str, str]:
+        """The game picked for each input, or None if nothing was picked."""
+        return {dropdown.user_input: dropdown.selection for dropdown in self.dropdowns}
 
     def embed(self) -> discord.Embed:
         embed = discord.Embed(title="We couldn't find an exact match.\nDid you mean one of these?")
-        embed.add_field(name="Your Input", value=f"```\n{self.user_input}```", inline=False)
+        user_input = "\n".join(dropdown.user_input for dropdown in self.dropdowns)
+        embed.add_field(name="Your Input", value=f"```\n{user_input}```", inline=False)
         return embed
 
+    async def answered(self):
+        # Only done once every dropdown has an answer
+        if all(dropdown.disabled for dropdown in self.dropdowns):
+            self.stop()
+
 
 class Dropdown(discord.ui.Select):
     def __init__(self, user_id: int, user_input: str, games: list[str]):
         self.user_id = user_id
         self.user_input = user_input
+        self.selection = None
         options = []
-        for game in games:
+        for game in games[: WhichGames.MAX_CHOICES]:
             options.append(discord.SelectOption(label=game, description="This One!"))
         options.append(
             discord.SelectOption(
@@ -161,7 +229,7 @@ class Dropdown(discord.ui.Select):
         options.append(
             discord.SelectOption(label="Add Game", description="Not seeing your game? Add it anyway.", value="add")
         )
-        super().__init__(placeholder="Choose Game", options=options)
+        super().__init__(placeholder=f"Choose Game for {user_input}"[:150], options=options)
 
     async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
@@ -170,14 +238,16 @@ class Dropdown(discord.ui.Select):
         selection = self.values[0]
         match selection:
             case "none":
-                await interaction.response.send_message("We couldn't find this game. Try again.", ephemeral=True)
+                await interaction.response.send_message(
+                    f"We couldn't find {self.user_input}. Try again.", ephemeral=True
+                )
             case "add":
-                self.view.selection = self.user_input
+                self.selection = self.user_input
                 await interaction.response.send_message(f"Alright I'll add {self.user_input}", ephemeral=True)
             case _:
-                self.view.selection = selection
-                await interaction.response.send_message(f"You selected {self.view.selection}.", ephemeral=True)
+                self.selection = selection
+                await interaction.response.send_message(f"You selected {self.selection}.", ephemeral=True)
         self.disabled = True
-        self.placeholder = self.view.selection
+        self.placeholder = self.selection
         await interaction.message.edit(view=self.view)
-        self.view.stop()
+        await self.view.answered()
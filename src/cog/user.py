@@ -1,116 +1,156 @@
 # A discord bot cog that manages user metadata
+import asyncio
 from discord.ui import View, Button
 import discord
 from discord.ext import commands
-from pony.orm import db_session
+from pony.orm import db_session, select
 from orm import Player, Game, SteamMetaData
+from search import fuzzy_names, game_names, rank, steam_names
 import logging
+import time
 from .converter import GameList
-from .ui import GameView, WhichGame
+from .ui import GamePages, GameView, WhichGames
 
 
 class UserCog(commands.Cog):
+    # How similar (0-1) a name has to be to the input before we suggest it as a possible typo
+    FUZZY_THRESHOLD = 0.6
+
     def __init__(self, bot):
         self.bot = bot
 
-    async def match_game(self, ctx: commands.Context, name: str) -> str:
-        # This function is contained in here to keep context the same and because it's not used elsewhere
-        async def get_selection(ctx: commands.Context, name: str, *possible_names: list[str]):
-            possible_names = set(possible_names)
-            # Dropdowns have a max length of 25
-            if len(possible_names) > 25:
-                await ctx.send(f"Too many games similar to {name}, please be more specific.", ephemeral=True)
-                return
-            view = WhichGame(ctx.author.id, name, *possible_names)
-            await ctx.send(embed=view.embed(), view=view, ephemeral=True)
-            await view.wait()
-            if view.selection:
-                return view.selection
+    @db_session
+    def find_games(self, names: list[str]) -> dict[str, str | list[str]]:
+        """Looks up every name at once.
 
-        # Clean up the string a bit before we search the tables
-        name = name.strip()
+        Each maps to the game to use, a list of games it could mean, or None if there's nothing like it.
+        """
+        found = {}
 
         # 1. Check if the name exists in the database. Note: we can have name dupes in the database,
         # so we will just use this name and fall back on the None SteamMetaData in calling method.
-        with db_session:
-            # TODO: switch to MetaData
-            games = Game.select(name=name)[:] or SteamMetaData.select(name=name)[:]
-            if games:
-                return games[0].name
-
-        # 2. Check if the name exists in the database with a different case
-        with db_session:
-            games = (
-                Game.select(lambda g: g.name.lower() == name.lower())[:]
-                # TODO: switch to MetaData
-                or SteamMetaData.select(lambda g: g.name.lower() == name.lower())[:]
-            )
-            if games:
-                possible_names = [game.name for game in games]
-                name = await get_selection(ctx, name, *possible_names)
-                # This will return None if no games are selected
-                return name
-
-        # 3. If not, check if the name exists with a different case or in partial form
-        with db_session:
-            if games:
-                games = list(Game.select(lambda g: g.name.lower().startswith(name.lower()))[:])
-                games.extend(Game.select(lambda g: g.name.lower().endswith(name.lower()))[:])
+        # TODO: switch to MetaData
+        exists = set(select(g.name for g in Game if g.name in names)[:])
+        exists.update(select(g.name for g in SteamMetaData if g.name in names)[:])
+
+        for name in names:
+            if name in exists:
+                found[name] = name
+                continue
+
+            # 2. Check if the name exists in the database with a different case
+            possible_names = game_names.exact(name) or steam_names.exact(name)
+            if possible_names:
+                found[name] = possible_names
+                continue
+
+            # 3. If not, check if the name exists in partial form. Step 2 returns on any case-insensitive
+            # match, so only the steam catalog is searched here.
+            if len(steam_names):
+                possible_names = steam_names.prefix(name) + steam_names.suffix(name)
             else:
-                # TODO: switch to MetaData
-                games = list(SteamMetaData.select(lambda g: g.name.lower().startswith(name.lower()))[:])
-                games.extend(SteamMetaData.select(lambda g: g.name.lower().endswith(name.lower()))[:])
-            if games:
-                possible_names = [game.name for game in games]
-                name = await get_selection(ctx, name, *possible_names)
-                # This will return None if no games are selected
-                return name
-
-        # 4. If we don't find a match, we just add the game
-        return name
+                # The catalog isn't loaded into memory, so ask the full text table instead
+                possible_names = SteamMetaData.search(name, limit=WhichGames.MAX_CHOICES, prefix=True)
+            if possible_names:
+                # Only show the closest ones if there are more than the dropdown can hold
+                found[name] = rank(name, possible_names, limit=WhichGames.MAX_CHOICES)
+                continue
+
+            # 4. Check the steam catalog for names with all the same words, in any order
+            possible_names = SteamMetaData.search(name, limit=WhichGames.MAX_CHOICES)
+            if possible_names:
+                found[name] = possible_names
+                continue
+
+            # 5. Check for typos or titles that are only partly right
+            possible_names = fuzzy_names.search(name, limit=WhichGames.MAX_CHOICES, threshold=self.FUZZY_THRESHOLD)
+            if possible_names:
+                found[name] = possible_names
+                continue
+
+            # 6. Nothing like it, match_games uses the name as it is
+            found[name] = None
+
+        return found
+
+    async def match_game(self, ctx: commands.Context, name: str) -> str:
+        names = await self.match_games(ctx, name)
+        # This will return None if no games are selected
+        return names[0] if names else None
 
     async def match_games(self, ctx: commands.Context, *names: list[str]) -> list[str]:
-        cleaned_names = []
+        # Clean up the strings a bit before we search the tables, and drop dupes but keep the order
+        names = list(dict.fromkeys(name.strip() for name in names))
+        found = await self.bot.db.run(self.find_games, names)
+
+        # 6. If we don't find a match, we just add the game
+        unmatched = [name for name in names if found[name] is None]
+        if unmatched and self.bot.warming_up:
+            await ctx.send(
+                f"I'm still loading the game catalog, so I couldn't check {', '.join(unmatched)} for similar "
+                "games. Using the names as typed."
+            )
+        for name in unmatched:
+            found[name] = name
 
+        choices = {}
         for name in names:
-            name = await self.match_game(ctx, name)
-            if name:
-                cleaned_names.append(name)
+            if isinstance(found[name], list):
+                # Drop dupes but keep the order, so ranked names stay ranked
+                possible_names = list(dict.fromkeys(found[name]))
+                if len(possible_names) > WhichGames.MAX_CHOICES:
+                    await ctx.send(f"Too many games similar to {name}, please be more specific.", ephemeral=True)
+                    found[name] = None
+                else:
+                    choices[name] = possible_names
+
+        # Every name that needs picking is asked about at once, rather than waiting on each in turn
+        choices = list(choices.items())
+        views = []
+        for i in range(0, len(choices), WhichGames.MAX_DROPDOWNS):
+            view = WhichGames(ctx.author.id, dict(choices[i : i + WhichGames.MAX_DROPDOWNS]))
+            await ctx.send(embed=view.embed(), view=view, ephemeral=True)
+            views.append(view)
+        await asyncio.gather(*(view.wait() for view in views))
+        for view in views:
+            found.update(view.selections)
 
-        return cleaned_names
+        # Names that nothing was selected for are left out
+        return [found[name] for name in names if found[name]]
 
     @commands.command()
     async def link(self, ctx: commands.Context, steam_id: str):
         """Register all games from your steam profile"""
-        games_data = self.bot.api.get_games(steam_id)
+        games_data = await self.bot.api.get_games(steam_id, fresh=True)
         if not games_data:
             await ctx.send("Invalid Steam ID or private profile.")
             return
-        appids = []
-        with db_session:
-            for game_data in games_data:
-                steam_metadata = SteamMetaData.get(appid=game_data["appid"])
-                if not steam_metadata:
-                    game_info = self.bot.api.get_games_by_id(game_data["appid"])
-                    if not game_info:
-                        continue
-                    name = game_info["name"]
-                    if not name:
-                        continue
-                    SteamMetaData(
-                        appid=game_data["appid"],
-                        name=name,
-                        game=Game(name=name),
-                    )
-                appids.append(game_data["appid"])
-
-        with db_session:
-            id = str(ctx.author.id)
-            name = ctx.author.name
-            user = Player.get(id=id) or Player(id=id, name=name)
-            user.add_games_with_appid(*appids)
-
-        await ctx.send(f"{len(appids)} added to {name}'s record")
+
+        status = None
+        last_update = time.monotonic()
+
+        async def progress(done: int, total: int):
+            nonlocal status, last_update
+            # Steam lookups for games missing from the catalog can take a while
+            if status is None:
+                status = await ctx.send(f"Looking up {total} games on Steam...")
+                return
+            # Editing the message on every lookup would get us rate limited by discord
+            if done < total and time.monotonic() - last_update < 5:
+                return
+            last_update = time.monotonic()
+            await status.edit(content=f"Looked up {done}/{total} games on Steam...")
+
+        # Everything is added again, in case games were removed by hand since the last link
+        appids = list(dict.fromkeys(game_data["appid"] for game_data in games_data))
+        name = ctx.author.name
+        added, failed = await self.bot.libraries.apply(
+            str(ctx.author.id), name, steam_id, appids, appids, progress=progress
+        )
+
+        await ctx.send(f"{added} added to {name}'s record")
+        if failed:
+            await ctx.send(f"Couldn't look up {len(failed)} games on Steam, try linking again later to add them.")
 
     @commands.command()
     async def add(self, ctx: commands.Context, *, games: GameList):
@@ -120,11 +160,13 @@ class UserCog(commands.Cog):
         if not games:
             return
 
-        id = str(ctx.author.id)
-        with db_session:
-            player = Player.get(id=id) or Player(id=id, name=ctx.author.name)
+        @db_session
+        def add_games(id: str, name: str, games: list[str]):
+            player = Player.get(id=id) or Player(id=id, name=name)
             player.add_games(*games)
 
+        await self.bot.db.run(add_games, str(ctx.author.id), ctx.author.name, games)
+
         logging.info(f"Added {games} to {ctx.author.name}")
         await ctx.message.add_reaction("👍")
 
@@ -136,12 +178,14 @@ class UserCog(commands.Cog):
         if not games:
             return
 
-        id = str(ctx.author.id)
-        with db_session:
+        @db_session
+        def remove_games(id: str, games: list[str]):
             player = Player.get(id=id)
             if player:
                 player.remove_games(*games)
 
+        await self.bot.db.run(remove_games, str(ctx.author.id), games)
+
         logging.info(f"Removed {games} from {ctx.author.name}")
         await ctx.message.add_reaction("👍")
 
@@ -153,12 +197,14 @@ class UserCog(commands.Cog):
         if not games:
             return
 
-        id = str(ctx.author.id)
-        with db_session:
+        @db_session
+        def add_banned_games(id: str, games: list[str]):
             player = Player.get(id=id)
             if player:
                 player.add_banned_games(*games)
 
+        await self.bot.db.run(add_banned_games, str(ctx.author.id), games)
+
         logging.info(f"Banned {games} from {ctx.author.name}")
         await ctx.message.add_reaction("👍")
 
@@ -170,12 +216,14 @@ class UserCog(commands.Cog):
         if not games:
             return
 
-        id = str(ctx.author.id)
-        with db_session:
+        @db_session
+        def remove_banned_games(id: str, games: list[str]):
             player = Player.get(id=id)
             if player:
                 player.remove_banned_games(*games)
 
+        await self.bot.db.run(remove_banned_games, str(ctx.author.id), games)
+
         logging.info(f"Unbanned {games} from {ctx.author.name}")
         await ctx.message.add_reaction("👍")
 
@@ -184,12 +232,12 @@ class UserCog(commands.Cog):
         """List games in the user profile"""
 
         async def callback(interaction: discord.Interaction, view_bans: bool):
-            with db_session:
-                player = Player.get(id=str(interaction.user.id))
-                games = sorted([games.name for games in player.get_games()])
-                bans = sorted([games.name for games in player.get_banned_games()])
+            id = str(interaction.user.id)
+            games = GamePages(self.bot.db, id)
+            bans = GamePages(self.bot.db, id, banned=True)
 
             view = GameView(interaction.user.id, games, bans, view_bans=view_bans)
+            await view.load()
             await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
 
         async def c1(interaction: discord.Interaction):
@@ -218,10 +266,8 @@ class UserCog(commands.Cog):
         if not hasattr(cur.activity, "type"):
             return
 
-        with db_session:
-            user = Player.get(id=str(cur.id)) or Player(id=str(cur.id), name=cur.name)
-            if cur.activity.type is discord.ActivityType.playing:
-                # Note: I am not using the match_games method here because I don't want to get the user involved.
-                game = cur.activity.name.strip()
-                user.add_games(game)
-                logging.info(f"User starting playing {cur.activity.name}. Added to user gamelist")
+        if cur.activity.type is discord.ActivityType.playing:
+            # Note: I am not using the match_games method here because I don't want to get the user involved.
+            game = cur.activity.name.strip()
+            # Buffered and written in batches, most of these are games the user already has
+            self.bot.presence.add(str(cur.id), cur.name, game)
@@ -0,0 +1,76 @@
+import asyncio
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from metrics import metrics
+from orm import query_count
+
+
+class DatabaseExecutor:
+    """Runs database work on its own thread, so slow queries and disk syncs don't block the event loop.
+
+    There is a single worker thread: Pony sessions and the objects they load belong to the thread that
+    opened them, and sqlite only takes one writer at a time anyway, so every call is run one after the
+    other. Functions open their own db_session (usually with the decorator) and should return plain
+    values rather than entities, since entities can't be used once their session is closed.
+    """
+
+    # Log a warning when a call sits in the queue for longer than this many seconds
+    SLOW_WAIT = 1.0
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self.pending = 0
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Calls `fn(*args, **kwargs)` on the database thread and returns the result."""
+        queued = time.perf_counter()
+        # Named after where they're defined, like UserCog.add.add_games. db_session hides that behind a wrapper.
+        name = getattr(inspect.unwrap(fn), "__qualname__", repr(fn)).replace("<locals>.", "")
+
+        def call():
+            started = time.perf_counter()
+            self._waited(started - queued)
+            queries = query_count()
+            try:
+                with metrics.timer("db_call", function=name):
+                    return fn(*args, **kwargs)
+            finally:
+                self.run_total += time.perf_counter() - started
+                metrics.count("db_queries", query_count() - queries, function=name)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            self.pending -= 1
+
+    def _waited(self, wait: float):
+        self.calls += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        metrics.observe("db_wait", wait)
+        if wait > self.SLOW_WAIT:
+            logging.warning(f"Database call waited {wait:.2f}s in the queue, {self.pending} calls pending")
+
+    def stats(self) -> dict[str, float]:
+        """Returns the queue depth, and the number of calls with their average wait and run times."""
+        calls = self.calls or 1
+        return {
+            "pending": self.pending,
+            "calls": self.calls,
+            "wait_avg": self.wait_total / calls,
+            "wait_max": self.wait_max,
+            "run_avg": self.run_total / calls,
+        }
+
+    def close(self):
+        # Lets anything already queued finish, so no writes are lost on shutdown
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,154 @@
+import gzip
+import json
+import re
+import time
+from typing import Iterator, Optional
+
+# The events replayed by benchmarks/replay_gateway.py, along with the guilds they happen in
+RECORDED = {
+    "GUILD_CREATE",
+    "GUILD_MEMBER_ADD",
+    "GUILD_MEMBER_REMOVE",
+    "GUILD_MEMBERS_CHUNK",
+    "MESSAGE_CREATE",
+    "PRESENCE_UPDATE",
+    "VOICE_STATE_UPDATE",
+}
+MENTION = re.compile(r"<(@!?|@&|#)(\d+)>")
+# Commands whose arguments identify someone outside discord, like $link and its steam id
+PRIVATE_ARGUMENTS = {"link"}
+
+
+class TraceRecorder:
+    """Writes the gateway events the bot handles to a gzipped trace, anonymized as they come in.
+
+    Every line is json: [seconds since the start, event type, data]. Ids are swapped for small numbers in
+    the order they're first seen, and user names for made up ones, so a trace can't be traced back to
+    anyone. Messages keep their content only if they're commands, without the arguments of $link, and
+    activities only their type and name. Guilds are reduced to their channels and member ids.
+    """
+
+    def __init__(self, path: str, prefix: str = "$"):
+        self.path = path
+        self.prefix = prefix
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._started = time.monotonic()
+        self._ids: dict[str, str] = {}
+        self.events = 0
+
+    def _id(self, id: Optional[str]) -> Optional[str]:
+        if id is None:
+            return None
+        if id not in self._ids:
+            self._ids[id] = str(1_000_000 + len(self._ids))
+        return self._ids[id]
+
+    def _user(self, user: dict) -> dict:
+        id = self._id(user["id"])
+        return {"id": id, "username": f"user{id}", "discriminator": "0", "avatar": None, "bot": user.get("bot", False)}
+
+    def _member(self, member: dict, user: dict) -> dict:
+        return {
+            "user": self._user(user),
+            "roles": [],
+            "joined_at": member.get("joined_at"),
+            "deaf": False,
+            "mute": False,
+        }
+
+    def _content(self, content: str) -> str:
+        if not content.startswith(self.prefix):
+            return ""
+        command = content[len(self.prefix) :].split(maxsplit=1)
+        if command and command[0] in PRIVATE_ARGUMENTS:
+            return self.prefix + command[0]
+        return MENTION.sub(lambda match: f"<{match.group(1)}{self._id(match.group(2))}>", content)
+
+    def anonymize(self, event: str, data: dict) -> Optional[dict]:
+        """Returns what's kept of an event, or None if it isn't worth keeping."""
+        guild_id = self._id(data.get("guild_id"))
+        if event == "GUILD_CREATE":
+            return {
+                "id": self._id(data["id"]),
+                "channels": [
+                    {"id": self._id(channel["id"]), "type": channel["type"], "name": channel["name"]}
+                    for channel in data.get("channels", [])
+                ],
+                "members": [self._user(member["user"]) for member in data.get("members", [])],
+            }
+        if event == "GUILD_MEMBERS_CHUNK":
+            # Big guilds only send their members in GUILD_CREATE when asked for them in chunks
+            return {"guild_id": guild_id, "members": [self._user(member["user"]) for member in data["members"]]}
+        if event in ("GUILD_MEMBER_ADD", "GUILD_MEMBER_REMOVE"):
+            return {**self._member(data, data["user"]), "guild_id": guild_id}
+        if event == "MESSAGE_CREATE":
+            # The bot's own messages come back when it's replayed
+            if not guild_id or data["author"].get("bot"):
+                return None
+            return {
+                "id": self._id(data["id"]),
+                "channel_id": self._id(data["channel_id"]),
+                "guild_id": guild_id,
+                "author": self._user(data["author"]),
+                "member": self._member(data.get("member", {}), data["author"]),
+                "content": self._content(data.get("content", "")),
+                "timestamp": data["timestamp"],
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": [],
+                "pinned": False,
+                "type": data.get("type", 0),
+            }
+        if event == "PRESENCE_UPDATE":
+            return {
+                "user": {"id": self._id(data["user"]["id"])},
+                "guild_id": guild_id,
+                "status": data.get("status", "offline"),
+                "activities": [
+                    {"type": activity["type"], "name": activity["name"]} for activity in data.get("activities", [])
+                ],
+                "client_status": data.get("client_status", {}),
+            }
+        if event == "VOICE_STATE_UPDATE":
+            user = data.get("member", {}).get("user", {"id": data["user_id"]})
+            return {
+                "guild_id": guild_id,
+                "channel_id": self._id(data.get("channel_id")),
+                "user_id": self._id(data["user_id"]),
+                "member": self._member(data.get("member", {}), user),
+                "session_id": "",
+                "deaf": data.get("deaf", False),
+                "mute": data.get("mute", False),
+                "self_deaf": data.get("self_deaf", False),
+                "self_mute": data.get("self_mute", False),
+                "self_video": False,
+                "suppress": False,
+                "request_to_speak_timestamp": None,
+            }
+        return None
+
+    def record(self, message: str | bytes):
+        """Takes a raw gateway message, from on_socket_raw_receive."""
+        payload = json.loads(message)
+        event = payload.get("t")
+        if event not in RECORDED:
+            return
+        data = self.anonymize(event, payload["d"])
+        if data is not None:
+            elapsed = round(time.monotonic() - self._started, 3)
+            self._file.write(json.dumps([elapsed, event, data], separators=(",", ":")) + "\n")
+            self.events += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path: str) -> Iterator[tuple[float, str, dict]]:
+    """Yields (seconds since the start, event type, data) for every event in a trace."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield tuple(json.loads(line))
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from discord.ext import tasks
+
+from executor import DatabaseExecutor
+from orm import SteamLink, SteamMetaData
+from steamapi import SteamAPI
+
+
+class LibrarySync:
+    """Keeps linked steam libraries up to date.
+
+    $link remembers the steam account and the appids it owned. Every `check_every` seconds the links that
+    haven't been synced for `interval` are fetched again, `batch_size` at a time and `spacing` seconds
+    apart so we stay well under steam's rate limits, and only the games that changed are applied.
+    """
+
+    def __init__(
+        self,
+        api: SteamAPI,
+        db: DatabaseExecutor,
+        interval: float = 24 * 60 * 60,
+        batch_size: int = 20,
+        spacing: float = 3.0,
+        check_every: float = 10 * 60,
+    ):
+        self.api = api
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.spacing = spacing
+        self._task = tasks.loop(seconds=check_every)(self.sync_due)
+
+    async def apply(
+        self,
+        player_id: str,
+        name: str,
+        steam_id: str,
+        owned: list[int],
+        added: list[int],
+        removed: list[int] = (),
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> tuple[int, list[int]]:
+        """Adds the `added` appids to the player, removes the `removed` ones and remembers `owned`.
+
+        Appids missing from the catalog are looked up on steam first, `progress` is awaited with (0, total)
+        before that starts and then as lookups finish. Returns how many games were added, and the appids
+        that couldn't be looked up. Those aren't remembered as owned, so the next sync tries them again.
+        """
+        appids, missing = await self.db.run(SteamMetaData.split_known, added)
+        failed = []
+        if missing:
+            if progress:
+                await progress(0, len(missing))
+            resolved, failed = await self.api.get_games_by_ids(missing, progress=progress)
+            appids += await self.db.run(SteamMetaData.add_details, resolved)
+
+        failed_set = set(failed)
+        owned = [appid for appid in owned if appid not in failed_set]
+        await self.db.run(SteamLink.update, player_id, name, steam_id, owned, appids, list(removed))
+        return len(appids), failed
+
+    async def sync(self, player_id: str, steam_id: str) -> Optional[tuple[int, int]]:
+        """Applies what changed in a linked library. Returns (added, removed), or None if it couldn't be fetched."""
+        games_data = await self.api.get_games(steam_id)
+        if not games_data:
+            # A private profile and a failed request look the same, and neither means they sold every game
+            await self.db.run(SteamLink.touch, player_id)
+            return None
+
+        owned = list(dict.fromkeys(game_data["appid"] for game_data in games_data))
+        previous = set(await self.db.run(SteamLink.get_appids, player_id))
+        added = [appid for appid in owned if appid not in previous]
+        removed = list(previous.difference(owned))
+        # Still applied when nothing changed, so the link is marked as synced
+        count, _ = await self.apply(player_id, "", steam_id, owned, added, removed)
+        return count, len(removed)
+
+    async def sync_due(self) -> int:
+        """Syncs one batch of the links that are due. Returns how many were synced."""
+        due = await self.db.run(SteamLink.due, time.time() - self.interval, self.batch_size)
+        for i, (player_id, steam_id) in enumerate(due):
+            if i:
+                await asyncio.sleep(self.spacing)
+            try:
+                changes = await self.sync(player_id, steam_id)
+            except Exception:
+                logging.exception(f"Failed to sync the steam library of {player_id}")
+                await self.db.run(SteamLink.touch, player_id)
+                continue
+            if changes and any(changes):
+                logging.info(f"Synced the steam library of {player_id}: {changes[0]} added, {changes[1]} removed")
+        return len(due)
+
+    def start(self):
+        if not self._task.is_running():
+            self._task.start()
+
+    def stop(self):
+        self._task.cancel()
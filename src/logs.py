@@ -0,0 +1,168 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Optional
+
+_listener: Optional[QueueListener] = None
+
+
+class Filter(object):
+    def __init__(self, level):
+        self.__level = level
+
+    def filter(self, logRecord):
+        return logRecord.levelno <= self.__level
+
+
+class JsonFormatter(logging.Formatter):
+    """One json object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RotatingFileHandler(TimedRotatingFileHandler):
+    """Starts a new file every `when` (midnight by default), or sooner once it reaches `max_bytes`.
+
+    Files rotated on size within the same period get a number on the end, so none are overwritten.
+    Writes aren't flushed one by one, BatchingQueueListener flushes once it has nothing left to write.
+    """
+
+    def __init__(self, filename: str, when: str = "midnight", max_bytes: int = 0, backup_count: int = 0):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.max_bytes = max_bytes
+        # Bytes in the current file, stream.tell() would flush the stream
+        self._bytes = 0
+
+    def _open(self):
+        stream = super()._open()
+        self._bytes = os.path.getsize(self.baseFilename)
+        return stream
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if super().shouldRollover(record):
+            return 1
+        return int(bool(self.max_bytes) and self._bytes >= self.max_bytes)
+
+    def emit(self, record: logging.LogRecord):
+        # BaseRotatingHandler.emit, with the bytes counted as they're written
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            message = self.format(record) + self.terminator
+            self.stream.write(message)
+            self._bytes += len(message.encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._bytes = 0
+
+    def rotation_filename(self, default_name: str) -> str:
+        name = super().rotation_filename(default_name)
+        directory, base = os.path.split(name)
+        # Numbered after the newest, not the first gap, since the oldest files get deleted
+        numbers = [
+            int(other[len(base) + 1 :])
+            for other in os.listdir(directory)
+            if other.startswith(base + ".") and other[len(base) + 1 :].isdigit()
+        ]
+        if numbers:
+            return f"{name}.{max(numbers) + 1}"
+        return f"{name}.1" if os.path.exists(name) else name
+
+    def getFilesToDelete(self) -> list[str]:
+        # The stdlib doesn't know about the numbers on the end, and newer versions skip those files
+        directory, base = os.path.split(self.baseFilename)
+        rotated = []
+        for name in os.listdir(directory):
+            if not name.startswith(base + "."):
+                continue
+            date, _, number = name[len(base) + 1 :].partition(".")
+            if self.extMatch.fullmatch(date) and (not number or number.isdigit()):
+                rotated.append((date, int(number or 0), os.path.join(directory, name)))
+        if len(rotated) <= self.backupCount:
+            return []
+        return [path for *_, path in sorted(rotated)[: len(rotated) - self.backupCount]]
+
+    def flush(self):
+        # StreamHandler.emit flushes after every record
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class BatchingQueueListener(QueueListener):
+    """Writes queued records on its own thread, and flushes the files once the queue runs dry."""
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                if isinstance(handler, RotatingFileHandler):
+                    handler.flush_batch()
+            return self.queue.get(block)
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            if isinstance(handler, RotatingFileHandler):
+                handler.flush_batch()
+
+
+def setup_logging(
+    directory: str = ".",
+    json_format: bool = False,
+    when: str = "midnight",
+    max_bytes: int = 50 * 1024 * 1024,
+    backup_count: int = 14,
+) -> QueueListener:
+    """Sends logging through a queue, so logging from the event loop never waits on the disk.
+
+    Info goes to stdout and everything to bot.log in `directory`, rotated every `when` and at
+    `max_bytes`, keeping `backup_count` old files. Only the first call sets things up, the rest return
+    the same listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter() if json_format else logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.addFilter(Filter(logging.INFO))
+    stream_handler.setFormatter(formatter)
+    os.makedirs(directory, exist_ok=True)
+    file_handler = RotatingFileHandler(os.path.join(directory, "bot.log"), when, max_bytes, backup_count)
+    file_handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    _listener = BatchingQueueListener(records, stream_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    # Writes whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(records))
+    root.setLevel(logging.INFO)
+    return _listener
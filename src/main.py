@@ -3,65 +3,158 @@ from discord.ext import commands
 import os
 import sys
 import logging
-from datetime import date
 from dotenv import load_dotenv
-from orm import SteamMetaData, init_database, db_session
+from orm import init_database, load_name_indexes, load_ownership
 from cog import UserCog, ServerCog
 from steamapi import SteamAPI
+from catalog import CatalogSync
+from library import LibrarySync
+from executor import DatabaseExecutor
+from presence import PresenceBuffer
+from steamcache import ResponseCache
+from gateway_trace import TraceRecorder
+from metrics import metrics
+from ownership import ownership
+from profiler import Profiler
+from logs import setup_logging
 import asyncio
+import time
 import traceback
 
 
 load_dotenv()
 
 
-class Filter(object):
-    def __init__(self, level):
-        self.__level = level
-
-    def filter(self, logRecord):
-        return logRecord.levelno <= self.__level
-
-
 class WhatShouldWePlayBot(commands.Bot):
     # These are the member id's for the bots, we ignore them for specific checks
     _MEMBER_IGNORE_LIST = [959263650701508638, 961433803484712960]
     _ignore_banlist = False
     api: SteamAPI = SteamAPI(os.getenv("API_KEY"))
 
-    def __init__(self, db_path: str = ":memory:"):
-        super().__init__(command_prefix="$", intents=discord.Intents.all())
-        stream_handler = logging.StreamHandler(sys.stdout)
-        stream_handler.setLevel(logging.INFO)
-        stream_handler.addFilter(Filter(logging.INFO))
-        file_handler = logging.FileHandler(f"{date.today()}.log")
-
-        logging.basicConfig(
-            format="%(asctime)s [%(levelname)s] %(message)s",
-            level=logging.INFO,
-            handlers=[stream_handler, file_handler],
-        )
+    def __init__(self, db_path: str = ":sharedmemory:", trace_path: str = None):
+        # Raw gateway messages are only passed on to on_socket_raw_receive with debug events on
+        super().__init__(command_prefix="$", intents=discord.Intents.all(), enable_debug_events=trace_path is not None)
+        self._started = time.perf_counter()
+        # Logging only queues records, a background thread writes and rotates the files
+        setup_logging(os.getenv("LOG_DIR", "."), json_format=os.getenv("LOG_JSON") == "1")
 
         init_database(db_path)
-
-    def sync_with_steam(self):
-        games = self.api.get_app_list()
-        with db_session:
-            SteamMetaData.add_games(games)
+        # $suggest needs this straight away, and it's small next to the name indexes the catalog needs
+        load_ownership()
+        self.log_phase("database ready")
+        # All database work after startup goes through here, to keep it off the event loop
+        self.db = DatabaseExecutor()
+        self.catalog = CatalogSync(self.api, self.db)
+        self.libraries = LibrarySync(self.api, self.db)
+        self.presence = PresenceBuffer(self.db)
+        self.api.cache = ResponseCache(self.db)
+        self.api.cache.load()
+        # True while the name indexes load and the catalog syncs in the background
+        self.warming_up = False
+        self._warm_up = None
+        self._connected = False
+        self._first_command = True
+        self.before_invoke(self._command_started)
+        self.after_invoke(self._command_finished)
+        metrics.gauge("db", self.db.stats)
+        metrics.gauge("suggest_cache", ownership.cache_stats)
+        metrics.gauge("steam_cache", self.api.cache.stats)
+        self._metrics_server = None
+        # Off until $admin profile turns it on for something
+        self.profiler = Profiler(self)
+        # Records gateway traffic for benchmarks/replay_gateway.py
+        self.recorder = TraceRecorder(trace_path) if trace_path else None
+
+    def log_phase(self, phase: str):
+        # Tracks how long startup takes, so it can be compared between releases
+        logging.info(f"Startup: {phase} after {time.perf_counter() - self._started:.2f}s")
+
+    async def sync_with_steam(self):
+        await self.catalog.sync()
+
+    async def warm_up(self):
+        """Loads the name indexes and syncs the catalog, while commands are already being answered."""
+        self.warming_up = True
+        try:
+            await self.db.run(load_name_indexes)
+            self.log_phase("name indexes loaded")
+            await self.sync_with_steam()
+            self.log_phase("catalog synced")
+        except Exception:
+            logging.exception("Warming up failed")
+        finally:
+            self.warming_up = False
+            # Keeps the catalog fresh while we're running, the first pass is skipped since we just synced
+            self.catalog.start()
+
+    async def setup_hook(self):
+        self.presence.start()
+        self.api.cache.start()
+        self.libraries.start()
+        self._warm_up = asyncio.create_task(self.warm_up())
+        # Prometheus can scrape http://127.0.0.1:METRICS_PORT/metrics, $admin stats shows the same numbers
+        port = os.getenv("METRICS_PORT")
+        if port:
+            self._metrics_server = await metrics.serve(int(port))
+
+    async def close(self):
+        if self._warm_up:
+            self._warm_up.cancel()
+            # Its cleanup starts the catalog sync, which is stopped right after
+            await asyncio.gather(self._warm_up, return_exceptions=True)
+        self.catalog.stop()
+        self.libraries.stop()
+        await self.api.close()
+        if self._metrics_server:
+            await self._metrics_server.cleanup()
+        await super().close()
+        # Nothing new comes in once we're disconnected, so write what's left before the database goes
+        await self.presence.close()
+        await self.api.cache.close()
+        self.db.close()
+        if self.recorder:
+            self.recorder.close()
+            logging.info(f"Recorded {self.recorder.events} gateway events to {self.recorder.path}")
 
     async def on_ready(self):
         logging.info(f"Logged in as user {self.user.name}")
+        if not self._connected:
+            self._connected = True
+            self.log_phase("connected to discord")
+
+    async def on_socket_raw_receive(self, message: str):
+        if self.recorder:
+            self.recorder.record(message)
+
+    async def _command_started(self, ctx: commands.Context):
+        ctx.started = time.perf_counter()
+        ctx.profile = None
+        if ctx.command.qualified_name in self.profiler.commands:
+            ctx.profile = self.profiler.start(ctx.command.qualified_name)
+
+    async def _command_finished(self, ctx: commands.Context):
+        # Called whether the command failed or not, failures are counted in on_command_error
+        metrics.observe("command", time.perf_counter() - ctx.started, command=ctx.command.qualified_name)
+        if ctx.profile:
+            self.profiler.finish(ctx.profile)
+            summary = await asyncio.to_thread(self.profiler.write, ctx.profile)
+            await ctx.send(f"```\n{summary[:1900]}\n```")
+
+    async def on_command_completion(self, ctx: commands.Context):
+        if self._first_command:
+            self._first_command = False
+            self.log_phase(f"first command ({ctx.command}) answered")
 
     async def on_command_error(self, ctx: commands.Context, error: commands.CommandInvokeError):
+        metrics.count("command_errors", command=ctx.command.qualified_name if ctx.command else "unknown")
         # For now, lets just dump the exception we get to the console
         traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
 
 
 async def main():
-    bot = WhatShouldWePlayBot(os.getenv("DB_PATH"))
+    bot = WhatShouldWePlayBot(os.getenv("DB_PATH"), trace_path=os.getenv("RECORD_TRACE"))
     await bot.add_cog(UserCog(bot))
     await bot.add_cog(ServerCog(bot))
-    bot.sync_with_steam()
     await bot.start(os.getenv("TOKEN"))
 
 
@@ -1,17 +1,49 @@
+import logging
+import re
+import threading
+import time
+from itertools import chain, islice
+from typing import Iterable
+
 from pony.orm import (
     Database,
     PrimaryKey,
     Set,
     Required,
     Optional,
-    MultipleObjectsFoundError,
     composite_key,
+    count,
     db_session,
+    flush,
     select,
 )
+from ownership import ownership
+from search import fuzzy_names, game_names, steam_names
 
 db = Database()
 _is_initialized = False  # Track initialization state
+_queries = threading.local()
+
+
+@db.on_connect(provider="sqlite")
+def _count_queries(db: Database, connection):
+    # Every thread gets its own connection, so the count is per thread
+    def traced(statement: str):
+        _queries.count = getattr(_queries, "count", 0) + 1
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            _queries.writes = getattr(_queries, "writes", 0) + 1
+
+    connection.set_trace_callback(traced)
+
+
+def query_count() -> int:
+    """Returns how many statements this thread has run, take it before and after to count a block's queries."""
+    return getattr(_queries, "count", 0)
+
+
+def write_count() -> int:
+    """Like query_count, but only the statements that insert, update or delete rows."""
+    return getattr(_queries, "writes", 0)
 
 
 class Game(db.Entity):
@@ -23,6 +55,15 @@ class Game(db.Entity):
     banners = Set("Player", reverse="banned")
     composite_key(name, steam_metadata)
 
+    def after_insert(self):
+        game_names.add(self.name)
+        fuzzy_names.add(self.name)
+        if self.player_count is not None:
+            ownership.set_player_count(self.name, self.player_count)
+
+    def after_update(self):
+        ownership.set_player_count(self.name, self.player_count)
+
     @db_session
     def set_player_count(self, count: int):
         self.player_count = count
@@ -38,34 +79,67 @@ class Player(db.Entity):
     name = Required(str)
     games = Set("Game", reverse="players")
     banned = Set("Game", reverse="banners")
+    steam_link = Optional("SteamLink")
 
     @db_session
     def add_games(self, *names: str):
-        for name in names:
-            try:
-                steam_metadata = SteamMetaData.get(name=name)
-            except MultipleObjectsFoundError:
-                steam_metadata = None  # Set to none for now, because we don't have appid
-            game = Game.get(name=name) or Game(name=name, steam_metadata=steam_metadata)
-            self.games += game
+        names = list(dict.fromkeys(names))
+        games = {game.name: game for game in _select_in(Game, "name", names)}
+        missing = [name for name in names if name not in games]
+        if missing:
+            steam_metadata = {}
+            for metadata in _select_in(SteamMetaData, "name", missing):
+                # Set to none for now when the name is on more than one app, because we don't have appid
+                steam_metadata[metadata.name] = None if metadata.name in steam_metadata else metadata
+            new = {name: steam_metadata.get(name) for name in missing}
+            games.update((game.name, game) for game in _insert_games(new))
+        self.games.add(games.values())
+        ownership.add_games(self.id, *names)
 
     def add_games_with_appid(self, *appids: int):
+        appids = list(dict.fromkeys(appids))
+        steam_metadata = {metadata.appid: metadata for metadata in _select_in(SteamMetaData, "appid", appids)}
+        # Looked up from the game's side, asking each SteamMetaData for its game would be a query each
+        linked = {
+            game.steam_metadata: game for game in _select_in(Game, "steam_metadata", list(steam_metadata.values()))
+        }
+        games_by_name = {
+            game.name: game for game in _select_in(Game, "name", [m.name for m in steam_metadata.values()])
+        }
+        games = []
+        # Games that don't exist yet, by name, with the app they'll be linked to
+        new = {}
+        # One at a time, so games sharing a name are linked the same way as looking each one up would
         for appid in appids:
-            steam_metadata = SteamMetaData.get(appid=appid)
-            game = Game.get(steam_metadata=steam_metadata)
+            metadata = steam_metadata.get(appid)
+            if metadata is None:
+                continue
+            game = linked.get(metadata)
             if not game:
-                game = Game.get(name=steam_metadata.name)
+                game = games_by_name.get(metadata.name)
                 if not game:
-                    game = Game(name=steam_metadata.name, steam_metadata=steam_metadata)
-                else:
-                    game.steam_metadata = steam_metadata
-            self.games += game
+                    new[metadata.name] = metadata
+                    continue
+                linked.pop(game.steam_metadata, None)
+                game.steam_metadata = metadata
+                linked[metadata] = game
+            games.append(game)
+        games += _insert_games(new)
+        self.games.add(games)
+        ownership.add_games(self.id, *[game.name for game in games])
+
+    def remove_games_with_appid(self, *appids: int):
+        steam_metadata = _select_in(SteamMetaData, "appid", list(appids))
+        games = _select_in(Game, "steam_metadata", steam_metadata)
+        self.games.remove(games)
+        ownership.remove_games(self.id, *[game.name for game in games])
 
     @db_session
     def add_banned_games(self, *names: str):
         for name in names:
             game = Game.get(name=name) or Game(name=name)
             self.banned += game
+        ownership.add_bans(self.id, *names)
 
     @db_session
     def remove_games(self, *names: str):
@@ -73,6 +147,7 @@ class Player(db.Entity):
             game = Game.get(name=name)
             if game:
                 self.games.remove(game)
+        ownership.remove_games(self.id, *names)
 
     @db_session
     def remove_banned_games(self, *names: str):
@@ -80,6 +155,23 @@ class Player(db.Entity):
             game = Game.get(name=name)
             if game:
                 self.banned.remove(game)
+        ownership.remove_bans(self.id, *names)
+
+    @db_session
+    def count_games(id: str, banned: bool = False) -> int:
+        """Returns how many games (or banned games) the player with this id has."""
+        if banned:
+            return count(g for p in Player if p.id == id for g in p.banned)
+        return count(g for p in Player if p.id == id for g in p.games)
+
+    @db_session
+    def get_game_names(id: str, start: int, stop: int, banned: bool = False) -> list[str]:
+        """Returns the names of the player's games (or banned games) from `start` to `stop`, sorted by name."""
+        if banned:
+            query = select(g.name for p in Player if p.id == id for g in p.banned)
+        else:
+            query = select(g.name for p in Player if p.id == id for g in p.games)
+        return query.order_by(1)[start:stop]
 
     @db_session
     def get_games(self) -> list["Game"]:
@@ -96,28 +188,287 @@ class SteamMetaData(db.Entity):
     name = Required(str)  # Games can have the same name, but not the same appid
     game = Optional(Game)
 
+    def after_insert(self):
+        steam_names.add(self.name)
+        fuzzy_names.add(self.name)
+
+    def add_games(games: Iterable[dict[str, str]], chunk_size: int = 10000) -> int:
+        """Bulk inserts steam apps we don't know about yet and returns how many were added.
+
+        Apps we already have are renamed if steam's name changed. Catalog loads can be hundreds of
+        thousands of rows, so this skips the ORM and writes chunks with executemany, one transaction
+        per chunk. `games` is read a chunk at a time, so it can be a generator to keep memory flat.
+        """
+        start = time.perf_counter()
+        games = iter(games)
+        added = renamed = 0
+        while chunk := list(islice(games, chunk_size)):
+            # The appid is unique, but there are dupes and nameless apps in the api response
+            rows = {}
+            for game in chunk:
+                if game["name"] and game["appid"] not in rows:
+                    rows[game["appid"]] = game["name"]
+
+            with db_session:
+                connection = db.get_connection()
+                # Indexing the search table row by row from the trigger is several times slower than
+                # indexing the whole chunk at once. Dropping the trigger is part of this transaction,
+                # so no other writer ever sees it missing.
+                connection.execute('DROP TRIGGER IF EXISTS "SteamMetaDataSearch_insert"')
+                (last_key,) = connection.execute('SELECT coalesce(max("key"), 0) FROM "SteamMetaData"').fetchone()
+                # Only rows whose name changed are updated, and the update trigger reindexes those
+                changed = connection.executemany(
+                    'INSERT INTO "SteamMetaData" ("appid", "name") VALUES (?, ?) '
+                    'ON CONFLICT ("appid") DO UPDATE SET "name" = excluded."name" WHERE "name" != excluded."name"',
+                    rows.items(),
+                ).rowcount
+                (inserted,) = connection.execute(
+                    'SELECT count(*) FROM "SteamMetaData" WHERE "key" > ?', (last_key,)
+                ).fetchone()
+                connection.execute(
+                    'INSERT INTO "SteamMetaDataSearch" (rowid, name) SELECT "key", "name" FROM "SteamMetaData" '
+                    'WHERE "key" > ?',
+                    (last_key,),
+                )
+                connection.execute(_SEARCH_INSERT_TRIGGER)
+
+            # Every name in the chunk is now in the table, the indexes skip the ones they already have
+            steam_names.add(*rows.values())
+            fuzzy_names.add(*rows.values())
+            added += inserted
+            renamed += changed - inserted
+
+        if added or renamed:
+            elapsed = time.perf_counter() - start
+            logging.info(
+                f"Added {added} and renamed {renamed} steam apps in {elapsed:.2f}s ({added / elapsed:.0f} rows/s)"
+            )
+        return added
+
     @db_session
-    def add_games(games: list[dict[str, str]]):
-        appids_set_cur = set(select(g.appid for g in SteamMetaData)[:])
-        appids_set_new = set(g["appid"] for g in games)
-        games_to_add = appids_set_new - appids_set_cur
+    def split_known(appids: list[int]) -> tuple[list[int], list[int]]:
+        """Splits appids into those in the catalog and those we have to look up on steam."""
+        known = {metadata.appid for metadata in _select_in(SteamMetaData, "appid", appids)}
+        return [appid for appid in appids if appid in known], [appid for appid in appids if appid not in known]
 
-        # Extract the games to add from the original games list
-        games_to_add_details = [game for game in games if game["appid"] in games_to_add]
+    @db_session
+    def add_details(resolved: dict[int, dict]) -> list[int]:
+        """Adds apps looked up on steam (appid -> appdetails) and returns the appids that had a name.
 
-        for game in games_to_add_details:
-            if not game["name"]:
+        Apps added since they were looked up (by another $link or a catalog sync) are left as they are,
+        and returned as known.
+        """
+        appids = []
+        known = {metadata.appid for metadata in _select_in(SteamMetaData, "appid", list(resolved))}
+        for appid, game_info in resolved.items():
+            if appid in known:
+                appids.append(appid)
                 continue
-            # The appid is unique, but there are dupes in the api response
-            if not SteamMetaData.get(appid=game["appid"]):
-                SteamMetaData(appid=game["appid"], name=game["name"])
-        return
+            name = game_info["name"]
+            if not name:
+                continue
+            # Games can share a name, add_games_with_appid links the metadata to an existing game
+            game = None if Game.get(name=name) else Game(name=name)
+            SteamMetaData(appid=appid, name=name, game=game)
+            appids.append(appid)
+        return appids
+
+    @db_session
+    def search(name: str, limit: int = 25, prefix: bool = False) -> list[str]:
+        """Returns the names of steam apps containing every word in `name`, best matches first.
+
+        The last word can be the start of a word, and with `prefix` the first word has to start the name.
+        Runs against the SteamMetaDataSearch full text table, so it needs nothing loaded in memory.
+        """
+        words = re.findall(r"\w+", name)
+        if not words:
+            return []
+        query = " ".join('"{}"'.format(word.replace('"', '""')) for word in words) + "*"
+        if prefix:
+            query = f"^{query}"
+        return db.select(
+            'SELECT "name" FROM "SteamMetaDataSearch" WHERE "SteamMetaDataSearch" MATCH $query '
+            "ORDER BY rank LIMIT $limit"
+        )
+
+
+class Setting(db.Entity):
+    # Small key/value store for bot state that needs to survive restarts
+    name = PrimaryKey(str)
+    value = Required(str)
+
+    @classmethod
+    @db_session
+    def get_value(cls, name: str, default: str = None) -> str:
+        setting = cls.get(name=name)
+        return setting.value if setting else default
+
+    @classmethod
+    @db_session
+    def set_value(cls, name: str, value: str):
+        setting = cls.get(name=name)
+        if setting:
+            setting.value = value
+        else:
+            cls(name=name, value=value)
 
 
-def init_database(db_path: str = ":memory:"):
+class SteamLink(db.Entity):
+    # The steam account a player linked, and the appids it owned when we last looked
+    key = PrimaryKey(int, auto=True)
+    player = Required(Player, unique=True)
+    steam_id = Required(str)
+    appids = Optional(str)  # Space separated
+    synced = Required(float, index=True)
+
+    @db_session
+    def get_appids(player_id: str) -> list[int]:
+        """Returns the appids the player's linked account owned last time, or none if they haven't linked."""
+        appids = select(link.appids for link in SteamLink if link.player.id == player_id).first()
+        return [int(appid) for appid in appids.split()] if appids else []
+
+    @db_session
+    def due(before: float, limit: int) -> list[tuple[str, str]]:
+        """Returns (player id, steam id) for up to `limit` links not synced since `before`, oldest first."""
+        query = select((link.player.id, link.steam_id, link.synced) for link in SteamLink if link.synced < before)
+        return [(player_id, steam_id) for player_id, steam_id, _ in query.order_by(3)[:limit]]
+
+    @db_session
+    def update(player_id: str, name: str, steam_id: str, appids: list[int], added: list[int], removed: list[int]):
+        """Adds and removes games by appid, and remembers `appids` as what the account owns now."""
+        player = Player.get(id=player_id) or Player(id=player_id, name=name)
+        player.add_games_with_appid(*added)
+        player.remove_games_with_appid(*removed)
+        appids = " ".join(str(appid) for appid in appids)
+        if player.steam_link:
+            player.steam_link.set(steam_id=steam_id, appids=appids, synced=time.time())
+        else:
+            SteamLink(player=player, steam_id=steam_id, appids=appids, synced=time.time())
+
+    @db_session
+    def touch(player_id: str):
+        # Pushes a link to the back of the queue when its library couldn't be fetched
+        link = SteamLink.select(lambda link: link.player.id == player_id).first()
+        if link:
+            link.synced = time.time()
+
+
+class SteamCache(db.Entity):
+    # Steam api responses as json, see steamcache.ResponseCache
+    key = PrimaryKey(str)
+    expires = Required(float, index=True)
+    value = Required(str)
+
+    @db_session
+    def load(now: float, limit: int) -> list[tuple[str, float, str]]:
+        """Returns (key, expires, value) rows that haven't expired, the `limit` that last longest, in expiry order."""
+        query = select((c.key, c.expires, c.value) for c in SteamCache if c.expires >= now)
+        return query.order_by(-2)[:limit][::-1]
+
+    @db_session
+    def save(rows: list[tuple[str, float, str]], removed: list[str], now: float):
+        """Writes (key, expires, value) rows, and deletes the removed keys along with anything expired."""
+        connection = db.get_connection()
+        connection.executemany(
+            'INSERT OR REPLACE INTO "SteamCache" ("key", "expires", "value") VALUES (?, ?, ?)',
+            rows,
+        )
+        connection.executemany('DELETE FROM "SteamCache" WHERE "key" = ?', [(key,) for key in removed])
+        connection.execute('DELETE FROM "SteamCache" WHERE "expires" < ?', (now,))
+
+
+def _insert_games(games: dict[str, "SteamMetaData | None"]) -> list[Game]:
+    """Inserts new games (name -> the steam app they're linked to, or None) and returns them.
+
+    Creating them through the orm costs a few queries per game, this is one executemany.
+    """
+    if not games:
+        return []
+    # An app can already have a game under its old name if steam renamed it. Those few go through the
+    # orm, which moves the link over to the new game.
+    linked = {game.steam_metadata for game in _select_in(Game, "steam_metadata", [m for m in games.values() if m])}
+    created = [Game(name=name, steam_metadata=metadata) for name, metadata in games.items() if metadata in linked]
+    games = {name: metadata for name, metadata in games.items() if metadata not in linked}
+    if not games:
+        return created
+    # Anything pending has to be written first, the insert goes around the orm
+    flush()
+    connection = db.get_connection()
+    (last_key,) = connection.execute('SELECT coalesce(max("key"), 0) FROM "Game"').fetchone()
+    rows = [(name, metadata.key if metadata else None) for name, metadata in games.items()]
+    connection.executemany('INSERT INTO "Game" ("name", "steam_metadata") VALUES (?, ?)', rows)
+    # after_insert doesn't run for these
+    game_names.add(*games)
+    fuzzy_names.add(*games)
+    # Read back by key, the orm would answer a query it has already run from its cache
+    return created + Game.select(lambda game: game.key > last_key)[:]
+
+
+def _select_in(entity: type[db.Entity], attr: str, values: list) -> list[db.Entity]:
+    """Returns the `entity` objects whose `attr` is one of `values`, with one IN query per chunk of values."""
+    # Older sqlite builds only allow 999 parameters in a query
+    chunk_size = 900
+    objects = []
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i : i + chunk_size]
+        objects += entity.select(lambda e: getattr(e, attr) in chunk)[:]
+    return objects
+
+
+def init_database(db_path: str = ":sharedmemory:"):
+    # In-memory databases are shared, so the database thread and the main thread see the same one
     global _is_initialized
     if _is_initialized:
         return
     _is_initialized = True
     db.bind(provider="sqlite", filename=db_path, create_db=True)
     db.generate_mapping(create_tables=True)
+    create_search_table()
+
+
+_SEARCH_INSERT_TRIGGER = (
+    'CREATE TRIGGER IF NOT EXISTS "SteamMetaDataSearch_insert" AFTER INSERT ON "SteamMetaData" BEGIN '
+    'INSERT INTO "SteamMetaDataSearch" (rowid, name) VALUES (new.key, new.name); END'
+)
+
+
+@db_session
+def create_search_table():
+    # A full text index over the steam catalog. The triggers keep it in step with SteamMetaData, and
+    # SteamMetaData.add_games indexes its bulk inserts itself.
+    exists = db.exists("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SteamMetaDataSearch'")
+    db.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "SteamMetaDataSearch" USING fts5('
+        "name, content='SteamMetaData', content_rowid='key', tokenize='unicode61 remove_diacritics 2')"
+    )
+    db.execute(_SEARCH_INSERT_TRIGGER)
+    db.execute(
+        'CREATE TRIGGER IF NOT EXISTS "SteamMetaDataSearch_delete" AFTER DELETE ON "SteamMetaData" BEGIN '
+        'INSERT INTO "SteamMetaDataSearch" ("SteamMetaDataSearch", rowid, name) '
+        "VALUES ('delete', old.key, old.name); END"
+    )
+    db.execute(
+        'CREATE TRIGGER IF NOT EXISTS "SteamMetaDataSearch_update" AFTER UPDATE OF name ON "SteamMetaData" BEGIN '
+        'INSERT INTO "SteamMetaDataSearch" ("SteamMetaDataSearch", rowid, name) '
+        "VALUES ('delete', old.key, old.name); "
+        'INSERT INTO "SteamMetaDataSearch" (rowid, name) VALUES (new.key, new.name); END'
+    )
+    if not exists:
+        # Databases from before the search table existed need their catalog indexed once
+        db.execute("""INSERT INTO "SteamMetaDataSearch" ("SteamMetaDataSearch") VALUES ('rebuild')""")
+
+
+@db_session
+def load_name_indexes():
+    game_names.build(select(g.name for g in Game)[:])
+    steam_names.build(select(g.name for g in SteamMetaData)[:])
+    fuzzy_names.build(chain(game_names, steam_names))
+
+
+@db_session
+def load_ownership():
+    ownership.build(
+        select((p.id, g.name) for p in Player for g in p.games)[:],
+        select((p.id, g.name) for p in Player for g in p.banned)[:],
+        select((g.name, g.player_count) for g in Game if g.player_count is not None)[:],
+    )
@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Callable, Iterable, Optional
+
+
+def bits(mask: int) -> Iterable[int]:
+    # Clearing bits off the int as we go would copy it every time, searching its binary string doesn't
+    digits = bin(mask)[:1:-1]
+    bit = digits.find("1")
+    while bit != -1:
+        yield bit
+        bit = digits.find("1", bit + 1)
+
+
+def mask(bits: Iterable[int]) -> int:
+    # Setting bits one at a time would copy the whole int for every bit, so set them in a buffer instead
+    bits = list(bits)
+    if not bits:
+        return 0
+    buffer = bytearray(max(bits) // 8 + 1)
+    for bit in bits:
+        buffer[bit >> 3] |= 1 << (bit & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class OwnershipIndex:
+    """Which games every player has and has banned, as bitsets.
+
+    Every game gets a bit, and every player an int with the bits of their games set (and another for
+    their bans), so finding the games a group has in common is an AND per player instead of building and
+    intersecting sets of names.
+
+    Suggestions are cached by the group of players, the player count and the ban mode. The cached
+    results that a change could affect are dropped as it happens: those with the player in the group for
+    library and ban changes, and those where the whole group has the game for player count changes.
+    """
+
+    # The number of suggestion results kept, least recently used go first
+    CACHE_SIZE = 1024
+
+    def __init__(self):
+        self._bits: dict[str, int] = {}
+        self._names: list[str] = []
+        self._games: dict[str, int] = {}
+        self._bans: dict[str, int] = {}
+        # Only games with a player count are in here, the rest support any number of players
+        self._player_counts: dict[int, int] = {}
+        self._cache: OrderedDict[tuple[frozenset[str], int, bool], list[str]] = OrderedDict()
+        # Changes come from the database thread while suggestions are made on the event loop
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def clear(self):
+        self._bits.clear()
+        self._names.clear()
+        self._games.clear()
+        self._bans.clear()
+        self._player_counts.clear()
+        self._invalidate(lambda key: True)
+
+    def _bit(self, name: str) -> int:
+        bit = self._bits.get(name)
+        if bit is None:
+            bit = self._bits[name] = len(self._names)
+            self._names.append(name)
+        return bit
+
+    def _mask(self, names: Iterable[str]) -> int:
+        return mask(self._bit(name) for name in names)
+
+    def _known_mask(self, names: Iterable[str]) -> int:
+        # For removals, a name without a bit isn't set for anyone, so there's no need to give it one
+        return mask(self._bits[name] for name in names if name in self._bits)
+
+    def _invalidate(self, affected: Callable[[tuple[frozenset[str], int, bool]], bool]):
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._cache if affected(key)]:
+                del self._cache[key]
+
+    def _update(self, masks: dict[str, int], player_id: str, mask: int):
+        if masks.get(player_id, 0) != mask:
+            masks[player_id] = mask
+            self._invalidate(lambda key: player_id in key[0])
+
+    def add_games(self, player_id: str, *names: str):
+        self._update(self._games, player_id, self._games.get(player_id, 0) | self._mask(names))
+
+    def remove_games(self, player_id: str, *names: str):
+        self._update(self._games, player_id, self._games.get(player_id, 0) & ~self._known_mask(names))
+
+    def add_bans(self, player_id: str, *names: str):
+        self._update(self._bans, player_id, self._bans.get(player_id, 0) | self._mask(names))
+
+    def remove_bans(self, player_id: str, *names: str):
+        self._update(self._bans, player_id, self._bans.get(player_id, 0) & ~self._known_mask(names))
+
+    def has_game(self, player_id: str, name: str) -> bool:
+        bit = self._bits.get(name)
+        return bit is not None and bool(self._games.get(player_id, 0) >> bit & 1)
+
+    def set_player_count(self, name: str, count: Optional[int]):
+        bit = self._bit(name)
+        if self._player_counts.get(bit) == count:
+            return
+        if count is None:
+            self._player_counts.pop(bit, None)
+        else:
+            self._player_counts[bit] = count
+        self._invalidate(lambda key: all(self._games.get(player_id, 0) >> bit & 1 for player_id in key[0]))
+
+    def build(
+        self,
+        games: Iterable[tuple[str, str]],
+        bans: Iterable[tuple[str, str]],
+        player_counts: Iterable[tuple[str, int]],
+    ):
+        """Loads (player id, game name) pairs for games and bans, and (game name, count) pairs."""
+        self.clear()
+        for pairs, masks in ((games, self._games), (bans, self._bans)):
+            names = defaultdict(list)
+            for player_id, name in pairs:
+                names[player_id].append(name)
+            for player_id, player_names in names.items():
+                masks[player_id] = self._mask(player_names)
+        self._invalidate(lambda key: True)
+        for name, count in player_counts:
+            self.set_player_count(name, count)
+
+    def suggest(self, player_ids: Iterable[str], player_count: int, ignore_bans: bool = False) -> list[str]:
+        """Returns the games every player has, that none of them banned and that support `player_count`."""
+        key = (frozenset(player_ids), player_count, ignore_bans)
+        with self._lock:
+            games = self._cache.get(key)
+            if games is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(games)
+            self.misses += 1
+            generation = self._generation
+
+        games = self._suggest(*key)
+        with self._lock:
+            # Anything that changed while we were working could have made this out of date already
+            if generation == self._generation:
+                self._cache[key] = games
+                if len(self._cache) > self.CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return list(games)
+
+    def cache_stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def _suggest(self, player_ids: frozenset[str], player_count: int, ignore_bans: bool) -> list[str]:
+        shared = None
+        banned = 0
+        for player_id in player_ids:
+            games = self._games.get(player_id, 0)
+            shared = games if shared is None else shared & games
+            if not shared:
+                return []
+            banned |= self._bans.get(player_id, 0)
+        if not shared:
+            return []
+        if not ignore_bans:
+            shared &= ~banned
+
+        counts = self._player_counts
+        return [self._names[bit] for bit in bits(shared) if counts.get(bit, player_count) >= player_count]
+
+
+# Kept up to date by the orm
+ownership = OwnershipIndex()
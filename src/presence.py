@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from collections import defaultdict
+from itertools import chain
+from typing import Iterable, Optional
+
+import discord
+from discord.ext import tasks
+
+from executor import DatabaseExecutor
+from orm import Player, db_session
+from ownership import ownership
+
+
+@db_session
+def add_observed_games(observed: dict[str, tuple[str, set[str]]]):
+    for id, (name, games) in observed.items():
+        player = Player.get(id=id) or Player(id=id, name=name)
+        player.add_games(*games)
+
+
+class PresenceBuffer:
+    """Collects the games players are seen playing and writes them in batches.
+
+    Presence updates come in constantly in busy guilds, and most of them are for games the player
+    already has. Those are dropped straight away, and the rest are written in one transaction every
+    `interval` seconds, or as soon as `max_size` games are waiting.
+    """
+
+    def __init__(self, db: DatabaseExecutor, interval: float = 10.0, max_size: int = 500):
+        self.db = db
+        self.max_size = max_size
+        self._observed: dict[str, tuple[str, set[str]]] = {}
+        self._size = 0
+        self._flushing: set[asyncio.Task] = set()
+        self._task = tasks.loop(seconds=interval)(self.flush)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, player_id: str, player_name: str, game: str):
+        if ownership.has_game(player_id, game) or not self._buffer(player_id, player_name, game):
+            return
+        if self._size >= self.max_size:
+            # Keep a reference, otherwise the task can be garbage collected before it's done
+            task = asyncio.create_task(self.flush())
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    def _buffer(self, player_id: str, player_name: str, game: str) -> bool:
+        _, games = self._observed.setdefault(player_id, (player_name, set()))
+        if game in games:
+            return False
+        games.add(game)
+        self._size += 1
+        return True
+
+    async def flush(self) -> int:
+        """Writes everything waiting in the buffer and returns the number of games written."""
+        if not self._observed:
+            return 0
+        observed, size = self._observed, self._size
+        self._observed, self._size = {}, 0
+        try:
+            await self.db.run(add_observed_games, observed)
+        except asyncio.CancelledError:
+            # Cancelled by close, the write may never have started so the last flush tries again
+            self._restore(observed)
+            raise
+        except Exception:
+            # Put them back to try again next time, anything seen since is merged in
+            self._restore(observed)
+            logging.exception(f"Failed to write {size} games from presence updates")
+            return 0
+        logging.info(f"Added {size} games from presence updates")
+        return size
+
+    def _restore(self, observed: dict[str, tuple[str, set[str]]]):
+        for player_id, (name, games) in observed.items():
+            for game in games:
+                self._buffer(player_id, name, game)
+
+    def start(self):
+        if not self._task.is_running():
+            self._task.start()
+
+    async def close(self):
+        # Waits for any flush already going, then writes whatever is left
+        task = self._task.get_task()
+        self._task.cancel()
+        await asyncio.gather(*self._flushing, *([task] if task else []), return_exceptions=True)
+        await self.flush()
+
+
+class PresenceIndex:
+    """Who is online and who is in each voice channel, for every guild.
+
+    A guild is loaded from the member cache the first time it's asked about, and kept current from
+    gateway events after that, so finding the players for $suggest doesn't mean going through every
+    member of the guild.
+    """
+
+    def __init__(self, ignore: Iterable[int] = ()):
+        # Member ids that are never counted, like the bots
+        self.ignore = set(ignore)
+        self._status: dict[int, dict[discord.Status, set[int]]] = {}
+        self._voice: dict[int, dict[int, set[int]]] = {}
+
+    def _load(self, guild: discord.Guild):
+        if guild.id in self._status:
+            return
+        status = defaultdict(set)
+        for member in guild.members:
+            if member.id not in self.ignore:
+                status[member.status].add(member.id)
+        voice = defaultdict(set)
+        for channel in guild.voice_channels:
+            voice[channel.id] = {member.id for member in channel.members if member.id not in self.ignore}
+        self._status[guild.id] = status
+        self._voice[guild.id] = voice
+
+    def online(self, guild: discord.Guild) -> set[int]:
+        self._load(guild)
+        return set(self._status[guild.id][discord.Status.online])
+
+    def in_channel(self, guild: discord.Guild, channel_id: int) -> set[int]:
+        self._load(guild)
+        return set(self._voice[guild.id][channel_id])
+
+    def update_status(self, member: discord.Member):
+        # Guilds nobody has asked about yet are loaded as they are when they're first needed
+        status = self._status.get(member.guild.id)
+        if status is None or member.id in self.ignore:
+            return
+        for members in status.values():
+            members.discard(member.id)
+        status[member.status].add(member.id)
+
+    def update_voice(
+        self, member: discord.Member, before: Optional[discord.VoiceChannel], after: Optional[discord.VoiceChannel]
+    ):
+        voice = self._voice.get(member.guild.id)
+        if voice is None or member.id in self.ignore:
+            return
+        if before is not None:
+            voice[before.id].discard(member.id)
+        if after is not None:
+            voice[after.id].add(member.id)
+
+    def remove_member(self, member: discord.Member):
+        for members in chain(
+            self._status.get(member.guild.id, {}).values(), self._voice.get(member.guild.id, {}).values()
+        ):
+            members.discard(member.id)
+
+    def remove_guild(self, guild: discord.Guild):
+        self._status.pop(guild.id, None)
+        self._voice.pop(guild.id, None)
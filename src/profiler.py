@@ -0,0 +1,157 @@
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+
+class Session:
+    """One profiled run of a command or listener."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.elapsed = 0.0
+        self.memory = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        self.memory_after = None
+        self.profile = cProfile.Profile()
+        self._start = time.perf_counter()
+        self.profile.enable()
+
+    def finish(self):
+        # Has to happen on the thread that started it, the report can be written anywhere
+        self.profile.disable()
+        self.elapsed = time.perf_counter() - self._start
+        if self.memory is not None:
+            self.memory_after = tracemalloc.take_snapshot()
+
+
+class Profiler:
+    """Profiles chosen commands and event listeners while the bot is running, turned on with $admin profile.
+
+    Commands are checked for in the bot's invoke hooks, and listeners are swapped for a profiled wrapper
+    only while they're being profiled, so nothing is added to anything else. Allocations are traced with
+    tracemalloc while anything is being profiled. Each run writes a .prof file (for pstats or snakeviz)
+    and a .txt summary to `directory`.
+
+    Only one run is profiled at a time, since cProfile can't nest. Everything else the event loop does
+    during the run shows up in it too. Listeners like presence_update can run many times a second, so
+    at most one run of each is profiled every `listener_interval` seconds.
+
+    cProfile only sees the event loop's thread. Work on the database thread shows up as time spent
+    waiting on it, its own breakdown is in $admin stats.
+    """
+
+    def __init__(self, bot, directory: str = "profiles", top: int = 15, listener_interval: float = 60.0):
+        self.bot = bot
+        self.directory = directory
+        self.top = top
+        self.listener_interval = listener_interval
+        self.commands: set[str] = set()
+        self._listeners: dict[str, list[tuple[Callable, Callable]]] = {}
+        # When each listener was last profiled
+        self._sampled: dict[str, float] = {}
+        self._active: Optional[Session] = None
+        self.last_report: Optional[str] = None
+
+    @property
+    def targets(self) -> list[str]:
+        return sorted(self.commands) + sorted(self._listeners)
+
+    def enable(self, target: str) -> bool:
+        """Profiles a command (by name) or listener (by event, like presence_update). False if there's neither."""
+        event = "on_" + target.removeprefix("on_")
+        if self.bot.get_command(target):
+            self.commands.add(self.bot.get_command(target).qualified_name)
+        elif self.bot.extra_events.get(event):
+            if event not in self._listeners:
+                listeners = self.bot.extra_events[event]
+                self._listeners[event] = [(listener, self._wrap(event, listener)) for listener in listeners]
+                listeners[:] = [wrapped for _, wrapped in self._listeners[event]]
+        else:
+            return False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return True
+
+    def disable(self, target: Optional[str] = None):
+        """Stops profiling a target, or everything without one."""
+        for command in [target] if target else list(self.commands):
+            command = self.bot.get_command(command)
+            if command:
+                self.commands.discard(command.qualified_name)
+        for event in ["on_" + target.removeprefix("on_")] if target else list(self._listeners):
+            wrapped = dict((wrapper, listener) for listener, wrapper in self._listeners.pop(event, []))
+            listeners = self.bot.extra_events.get(event, [])
+            listeners[:] = [wrapped.get(listener, listener) for listener in listeners]
+        if not self.targets and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def start(self, name: str) -> Optional[Session]:
+        """Starts profiling a run, unless another is already being profiled."""
+        if self._active:
+            return None
+        self._active = Session(name)
+        return self._active
+
+    def finish(self, session: Session):
+        session.finish()
+        self._active = None
+
+    def write(self, session: Session) -> str:
+        """Writes the reports for a finished run and returns the summary. Slow, so run it off the event loop."""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(session.started))
+        path = os.path.join(self.directory, f"{stamp}-{session.name.replace(' ', '_')}")
+        session.profile.dump_stats(f"{path}.prof")
+
+        out = io.StringIO()
+        out.write(f"{session.name} took {session.elapsed * 1000:.0f}ms\n\n")
+        stats = pstats.Stats(session.profile, stream=out)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(self.top)
+        if session.memory_after is not None:
+            out.write(f"Top {self.top} allocations:\n")
+            for diff in session.memory_after.compare_to(session.memory, "lineno")[: self.top]:
+                out.write(f"  {diff}\n")
+        report = out.getvalue()
+        with open(f"{path}.txt", "w", encoding="utf-8") as f:
+            f.write(report)
+        logging.info(f"Profiled {session.name} in {session.elapsed * 1000:.0f}ms, report at {path}.txt")
+
+        self.last_report = self.summary(session, stats)
+        return self.last_report
+
+    def summary(self, session: Session, stats: pstats.Stats) -> str:
+        # Short enough for a discord message: the slowest functions by cumulative time
+        lines = [f"{session.name}: {session.elapsed * 1000:.0f}ms"]
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])
+        for (file, line, function), (_, calls, _, cumulative, _) in rows[: self.top]:
+            lines.append(f"{cumulative * 1000:>8.1f}ms {calls:>6}  {function} ({file}:{line})")
+        if session.memory_after is not None:
+            grown = sum(diff.size_diff for diff in session.memory_after.compare_to(session.memory, "filename"))
+            lines.append(f"Memory: {grown / 1024:+.0f} KB")
+        lines.append("Event loop thread only, database work shows as waiting on it (see $admin stats)")
+        return "\n".join(lines)
+
+    def _wrap(self, event: str, listener: Callable) -> Callable:
+        @functools.wraps(listener)
+        async def profiled(*args, **kwargs):
+            session = None
+            now = time.monotonic()
+            if now - self._sampled.get(event, -self.listener_interval) >= self.listener_interval:
+                session = self.start(event)
+                if session:
+                    self._sampled[event] = now
+            try:
+                return await listener(*args, **kwargs)
+            finally:
+                if session:
+                    self.finish(session)
+                    await asyncio.to_thread(self.write, session)
+
+        return profiled
@@ -0,0 +1,164 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Iterable, Iterator
+
+
+class NameIndex:
+    """An in-memory index for case-insensitive exact, prefix and suffix name lookups.
+
+    Names are lowered with str.lower, the same as Pony's lower() in sqlite, so results match the
+    equivalent `g.name.lower() ...` queries.
+    """
+
+    # Past this many names it's cheaper to append and re-sort than to insert one at a time
+    _BULK_ADD = 64
+
+    def __init__(self):
+        self._names = set()
+        self._exact: dict[str, set[str]] = {}
+        # (lowered name, name) pairs sorted by the lowered name, and the same with the lowered name reversed
+        self._prefix: list[tuple[str, str]] = []
+        self._suffix: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def clear(self):
+        self._names.clear()
+        self._exact.clear()
+        self._prefix.clear()
+        self._suffix.clear()
+
+    def add(self, *names: str):
+        names = [name for name in set(names) if name not in self._names]
+        if not names:
+            return
+        self._names.update(names)
+        prefix = [(name.lower(), name) for name in names]
+        suffix = [(lowered[::-1], name) for lowered, name in prefix]
+        for lowered, name in prefix:
+            self._exact.setdefault(lowered, set()).add(name)
+
+        if len(names) > self._BULK_ADD:
+            self._prefix.extend(prefix)
+            self._prefix.sort()
+            self._suffix.extend(suffix)
+            self._suffix.sort()
+        else:
+            for entry in prefix:
+                insort(self._prefix, entry)
+            for entry in suffix:
+                insort(self._suffix, entry)
+
+    def build(self, names: Iterable[str]):
+        self.clear()
+        self.add(*names)
+
+    def exact(self, name: str) -> list[str]:
+        """Returns every name equal to `name`, ignoring case."""
+        return list(self._exact.get(name.lower(), ()))
+
+    def prefix(self, name: str) -> list[str]:
+        """Returns every name that starts with `name`, ignoring case."""
+        return NameIndex._range(self._prefix, name.lower())
+
+    def suffix(self, name: str) -> list[str]:
+        """Returns every name that ends with `name`, ignoring case."""
+        return NameIndex._range(self._suffix, name.lower()[::-1])
+
+    def _range(entries: list[tuple[str, str]], start: str) -> list[str]:
+        # Cutting every key down to len(start) keeps the list sorted, and all the matches end up next
+        # to each other, so two binary searches find the whole run.
+        length = len(start)
+
+        def key(entry: tuple[str, str]) -> str:
+            return entry[0][:length]
+
+        lo = bisect_left(entries, start, key=key)
+        hi = bisect_right(entries, start, lo=lo, key=key)
+        return [name for _, name in entries[lo:hi]]
+
+
+def trigrams(name: str) -> set[str]:
+    # Padding the front twice and the back once weights the start of a name more than the end
+    padded = f"  {name.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def rank(query: str, names: Iterable[str], limit: int = 25) -> list[str]:
+    """Returns the `limit` names most similar to `query`, best first."""
+    grams = trigrams(query)
+    return heapq.nlargest(limit, set(names), key=lambda name: similarity(grams, trigrams(name)))
+
+
+class TrigramIndex:
+    """Fuzzy name search, ranking names by the similarity of their trigrams to the query.
+
+    Every trigram maps to the ids of the names that contain it, so a search only touches names that
+    share at least one trigram with the query instead of scanning all of them.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+        self._sizes = array("H")
+        self._postings: dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def clear(self):
+        self._ids.clear()
+        self._names.clear()
+        self._sizes = array("H")
+        self._postings.clear()
+
+    def add(self, *names: str):
+        for name in names:
+            if name in self._ids:
+                continue
+            id = len(self._names)
+            self._ids[name] = id
+            self._names.append(name)
+            grams = trigrams(name)
+            self._sizes.append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array("I")
+                postings.append(id)
+
+    def build(self, names: Iterable[str]):
+        self.clear()
+        self.add(*names)
+
+    def search(self, query: str, limit: int = 25, threshold: float = 0.0) -> list[str]:
+        """Returns up to `limit` names that are at least `threshold` similar to `query`, best first."""
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings:
+                shared.update(postings)
+
+        size = len(grams)
+        scored = ((count / (size + self._sizes[id] - count), id) for id, count in shared.items())
+        return [self._names[id] for score, id in heapq.nlargest(limit, scored) if score >= threshold]
+
+
+# Names of everything in the Game and SteamMetaData tables, kept up to date by the orm
+game_names = NameIndex()
+steam_names = NameIndex()
+fuzzy_names = TrigramIndex()
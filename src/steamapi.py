@@ -1,48 +1,339 @@
-import requests
+import asyncio
+import codecs
 import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 load_dotenv()
 
 
+class SteamAPIError(Exception):
+    pass
+
+
+class TokenBucket:
+    """An asyncio token bucket. Callers wait in acquire() until a token is available."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Take the token up front, going into debt if needed, and sleep until the debt is paid off.
+        # Reserving before sleeping keeps waiters in FIFO order without needing a lock.
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class AppListParser:
+    """Pulls the apps out of a GetAppList body as it downloads, so the whole thing is never in memory.
+
+    Feed it the body a piece at a time, and it returns the apps that were completed by each piece.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._in_apps = False
+        self.done = False
+
+    def feed(self, data: bytes) -> list[dict]:
+        self._buffer += self._text.decode(data)
+        pos = 0
+        if not self._in_apps:
+            start = self._buffer.find('"apps"')
+            bracket = self._buffer.find("[", start) if start != -1 else -1
+            if bracket == -1:
+                return []
+            self._in_apps = True
+            pos = bracket + 1
+
+        apps = []
+        buffer = self._buffer
+        while not self.done:
+            # Skip to the start of the next app
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                break
+            try:
+                app, pos = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Only part of this one has arrived, it'll be finished by the next piece
+                break
+            apps.append(app)
+        self._buffer = buffer[pos:]
+        return apps
+
+
 class SteamAPI:
-    def __init__(self, API_KEY):
+    API_URL = "https://api.steampowered.com"
+    STORE_URL = "https://store.steampowered.com"
+    # Status codes worth retrying, everything else is treated as a final answer
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # The store api (appdetails) allows roughly 200 requests every 5 minutes per ip
+    STORE_RATE = 200 / 300
+    STORE_BURST = 50
+    # How long responses are cached for, in seconds. Libraries change a lot more often than app details.
+    CACHE_TTLS = {"GetOwnedGames": 6 * 60 * 60, "appdetails": 7 * 24 * 60 * 60}
+    # How long failed lookups and unknown apps are remembered for
+    NEGATIVE_TTL = 15 * 60
+
+    def __init__(
+        self,
+        API_KEY,
+        api_url: str = None,
+        store_url: str = None,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 20,
+        cache=None,
+    ):
         self.API_KEY = API_KEY
+        self.api_url = (api_url or self.API_URL).rstrip("/")
+        self.store_url = (store_url or self.STORE_URL).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.store_limiter = TokenBucket(self.STORE_RATE, self.STORE_BURST)
+        # Anything with get(key) and set(key, value, ttl), like steamcache.ResponseCache
+        self.cache = cache
+        self._session = None
+        self._loop = None
 
-    def get_games(self, steamid):
-        req = requests.get(
-            f"https://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={self.API_KEY}&steamid={steamid}"
-        )
-        if req.status_code != 200:
-            return []
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the shared session, creating it on first use in the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def _get(self, url: str, params: dict = None, limiter: TokenBucket = None):
+        """Returns the decoded json body, or None if steam never gave us a good response."""
+        # The path without the host, like IPlayerService/GetOwnedGames/v0001/
+        endpoint = url.split("://", 1)[-1].partition("/")[2]
+        with metrics.timer("steam_request", endpoint=endpoint):
+            data = await self._fetch(url, params, limiter)
+        if data is None:
+            metrics.count("steam_request_errors", endpoint=endpoint)
+        return data
+
+    async def _fetch(self, url: str, params: dict, limiter: Optional[TokenBucket]):
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2**attempt
+            if limiter:
+                await limiter.acquire()
+            try:
+                async with self.session().get(url, params=params) as resp:
+                    if resp.status == 200:
+                        return await resp.json(content_type=None)
+                    if resp.status not in self.RETRY_STATUSES:
+                        return None
+                    # Steam sometimes tells us how long to back off for
+                    retry_after = resp.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    logging.warning(f"Steam returned {resp.status} for {url} (attempt {attempt + 1})")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.warning(f"Steam request to {url} failed (attempt {attempt + 1}): {e!r}")
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        return None
+
+    def _cached(self, endpoint: str, key) -> Optional[Any]:
+        return self.cache.get(f"{endpoint}:{key}") if self.cache is not None else None
 
-        games = json.loads(req.text)["response"]
+    def _cache(self, endpoint: str, key, value):
+        if self.cache is not None:
+            self.cache.set(f"{endpoint}:{key}", value, self.CACHE_TTLS[endpoint] if value else self.NEGATIVE_TTL)
+
+    async def _stream(self, url: str, params: dict = None) -> AsyncIterator[bytes]:
+        """Yields the body in pieces as it downloads.
+
+        Retries like _get until the download starts. Raises SteamAPIError if it never does, or if it
+        breaks off partway, since by then the caller has already used the start of it.
+        """
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2**attempt
+            try:
+                async with self.session().get(url, params=params) as resp:
+                    if resp.status == 200:
+                        try:
+                            async for data in resp.content.iter_chunked(64 * 1024):
+                                yield data
+                        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                            raise SteamAPIError(f"Download from {url} broke off: {e!r}") from e
+                        return
+                    if resp.status not in self.RETRY_STATUSES:
+                        raise SteamAPIError(f"Steam returned {resp.status} for {url}")
+                    retry_after = resp.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    logging.warning(f"Steam returned {resp.status} for {url} (attempt {attempt + 1})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Steam request to {url} failed (attempt {attempt + 1}): {e!r}")
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        raise SteamAPIError(f"Failed to download {url}")
+
+    async def get_games(self, steamid, fresh: bool = False):
+        """The games a steam user owns. `fresh` skips the cache, for when the user asked for it themselves."""
+        games = None if fresh else self._cached("GetOwnedGames", steamid)
+        if games is not None:
+            return games
+
+        data = await self._get(
+            f"{self.api_url}/IPlayerService/GetOwnedGames/v0001/",
+            params={"key": self.API_KEY, "steamid": steamid},
+        )
+        games = data["response"].get("games", []) if data else []
+        # An empty library is a private profile or a failed request, both can change any minute
         if games:
-            return games["games"]
-        else:
-            return []
+            self._cache("GetOwnedGames", steamid, games)
+        return games
 
-    def get_steam_id(self, username):
-        req = requests.get(
-            f"http://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/?key={self.API_KEY}&vanityurl={username}"
+    async def get_steam_id(self, username):
+        data = await self._get(
+            f"{self.api_url}/ISteamUser/ResolveVanityURL/v0001/",
+            params={"key": self.API_KEY, "vanityurl": username},
         )
-        if req.status_code != 200:
-            return []
+        if not data:
+            return None
 
-        return json.loads(req.text)["response"]["steamid"]
+        return data["response"].get("steamid")
 
-    def get_app_list(self):
-        req = requests.get("http://api.steampowered.com/ISteamApps/GetAppList/v2/")
-        if req.status_code != 200:
+    async def get_app_list(self):
+        try:
+            return [app async for apps in self.get_app_list_chunks() for app in apps]
+        except SteamAPIError as e:
+            logging.warning(f"Failed to fetch the app list: {e}")
             return []
-        else:
-            return json.loads(req.text)["applist"]["apps"]
 
-    def get_games_by_id(self, appid):
-        req = requests.get(f"http://store.steampowered.com/api/appdetails?appids={appid}")
-        if req.status_code != 200:
-            return []
-        if not json.loads(req.text)[str(appid)]["success"]:
-            return []
+    async def get_app_list_chunks(self, chunk_size: int = 50000) -> AsyncIterator[list[dict]]:
+        """Yields every app (ISteamApps/GetAppList/v2) in chunks of `chunk_size`, parsed as it downloads.
+
+        Memory use stays the same however big the catalog gets. Raises SteamAPIError if the list can't
+        be fetched in full, after yielding whatever came before the failure.
+        """
+        parser = AppListParser()
+        chunk = []
+        async for data in self._stream(f"{self.api_url}/ISteamApps/GetAppList/v2/"):
+            chunk += parser.feed(data)
+            while len(chunk) >= chunk_size:
+                yield chunk[:chunk_size]
+                chunk = chunk[chunk_size:]
+        if chunk:
+            yield chunk
+        if not parser.done:
+            raise SteamAPIError("The app list ended early")
+
+    async def get_app_list_pages(self, if_modified_since: int = 0, page_size: int = 50000) -> AsyncIterator[list[dict]]:
+        """Yields pages of apps changed since `if_modified_since` (a unix timestamp, 0 for everything).
+
+        Uses the incremental IStoreService app list, which needs an API key. Raises SteamAPIError if a
+        page can't be fetched, so callers know the listing is incomplete.
+        """
+        last_appid = 0
+        while True:
+            data = await self._get(
+                f"{self.api_url}/IStoreService/GetAppList/v1/",
+                params={
+                    "key": self.API_KEY,
+                    "if_modified_since": if_modified_since,
+                    "include_games": "true",
+                    "include_dlc": "true",
+                    "include_software": "true",
+                    "last_appid": last_appid,
+                    "max_results": page_size,
+                },
+            )
+            if not data:
+                raise SteamAPIError(f"Failed to fetch the app list after appid {last_appid}")
+
+            response = data.get("response", {})
+            yield response.get("apps", [])
+            if not response.get("have_more_results"):
+                return
+            last_appid = response["last_appid"]
+
+    async def get_games_by_id(self, appid):
+        details = self._cached("appdetails", appid)
+        if details is not None:
+            return details
+
+        data = await self._get(
+            f"{self.store_url}/api/appdetails",
+            params={"appids": appid},
+            limiter=self.store_limiter,
+        )
+        if not data or not data.get(str(appid), {}).get("success"):
+            details = []
         else:
-            return json.loads(req.text)[str(appid)]["data"]
+            # The full details run to tens of KB with descriptions and screenshots, only the name is used
+            details = {"name": data[str(appid)]["data"]["name"]}
+        self._cache("appdetails", appid, details)
+        return details
+
+    async def get_games_by_ids(
+        self,
+        appids: list[int],
+        concurrency: int = 4,
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> tuple[dict[int, dict], list[int]]:
+        """Looks up many appids at once, staying under the store rate limit.
+
+        Returns the details for every appid that resolved, along with the appids that didn't, so a
+        few bad lookups don't throw away the rest. `progress` is awaited with (done, total) as
+        lookups finish.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        resolved = {}
+        failed = []
+        done = 0
+
+        async def resolve(appid: int):
+            nonlocal done
+            async with semaphore:
+                details = await self.get_games_by_id(appid)
+            if details:
+                resolved[appid] = details
+            else:
+                failed.append(appid)
+            done += 1
+            if progress:
+                await progress(done, len(appids))
+
+        await asyncio.gather(*(resolve(appid) for appid in appids))
+        return resolved, failed
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from discord.ext import tasks
+
+from executor import DatabaseExecutor
+from orm import SteamCache
+
+
+class ResponseCache:
+    """An LRU cache for steam api responses, with expiry, saved to the database so it survives restarts.
+
+    Lookups only touch memory. Changes are written to the SteamCache table in one transaction every
+    `interval` seconds, and when the cache is closed.
+    """
+
+    def __init__(self, db: DatabaseExecutor, max_size: int = 20000, interval: float = 60.0):
+        self.db = db
+        self.max_size = max_size
+        # key -> (expires, value), least recently used first
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._changed: set[str] = set()
+        self._removed: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self._task = tasks.loop(seconds=interval)(self.flush)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self):
+        """Reads back the entries that haven't expired yet, up to `max_size` of them."""
+        self._entries.clear()
+        for key, expires, value in SteamCache.load(time.time(), self.max_size):
+            self._entries[key] = (expires, json.loads(value))
+        logging.info(f"Loaded {len(self._entries)} cached steam responses")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if there isn't one or it has expired."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.time():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        self._changed.add(key)
+        self._removed.discard(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        del self._entries[key]
+        self._changed.discard(key)
+        self._removed.add(key)
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+    async def flush(self):
+        if not self._changed and not self._removed:
+            return
+        changed = [(key, *self._entries[key]) for key in self._changed]
+        removed = list(self._removed)
+        self._changed, self._removed = set(), set()
+
+        def save():
+            # Serialized on the database thread, so the event loop doesn't spend its time on it
+            rows = [(key, expires, json.dumps(value)) for key, expires, value in changed]
+            SteamCache.save(rows, removed, time.time())
+
+        try:
+            await self.db.run(save)
+        except asyncio.CancelledError:
+            # Cancelled by close, the save may never have started so the last flush tries again
+            self._restore(changed, removed)
+            raise
+        except Exception:
+            # Try again next time
+            self._restore(changed, removed)
+            logging.exception("Failed to save the steam response cache")
+
+    def _restore(self, changed: list[tuple], removed: list[str]):
+        # Unless they've been changed or dropped since
+        self._changed.update(key for key, *_ in changed if key in self._entries)
+        self._removed.update(key for key in removed if key not in self._entries)
+
+    def start(self):
+        if not self._task.is_running():
+            self._task.start()
+
+    async def close(self):
+        # Waits for a flush already going, then writes whatever is left
+        task = self._task.get_task()
+        self._task.cancel()
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,93 @@
+import pytest
+from catalog import CatalogSync
+from executor import DatabaseExecutor
+from orm import Setting, SteamMetaData, db_session, init_database
+from search import steam_names
+from steamapi import SteamAPIError
+
+
+class FakeSteam:
+    API_KEY = "KEY"
+
+    def __init__(self, *pages: list[dict]):
+        self.pages = pages
+        self.calls = []
+
+    async def get_app_list_pages(self, if_modified_since: int = 0):
+        self.calls.append(if_modified_since)
+        for page in self.pages:
+            if page is None:
+                raise SteamAPIError("Steam is down")
+            yield page
+
+
+@pytest.fixture
+def catalog():
+    init_database()
+    Setting.set_value(CatalogSync.LAST_SYNCED, "0")
+
+
+@pytest.mark.asyncio
+async def test_incremental_sync(catalog):
+    api = FakeSteam([{"appid": 9001, "name": "Synced App 9001"}], [{"appid": 9002, "name": "Synced App 9002"}])
+    sync = CatalogSync(api, DatabaseExecutor())
+    assert await sync.sync() == 2
+    with db_session:
+        assert SteamMetaData.get(appid=9002).name == "Synced App 9002"
+    marker = await sync.last_synced()
+    assert marker > 0
+
+    # A fresh snapshot means a restart doesn't touch steam at all
+    assert await sync.sync() == 0
+    assert api.calls == [0]
+
+    # Forced syncs only ask for what changed since the marker
+    await sync.sync(force=True)
+    assert api.calls == [0, marker]
+
+
+@pytest.mark.asyncio
+async def test_failed_sync_keeps_marker(catalog):
+    api = FakeSteam([{"appid": 9003, "name": "Synced App 9003"}], None)
+    sync = CatalogSync(api, DatabaseExecutor())
+    assert await sync.sync() == 1
+    assert await sync.last_synced() == 0
+    with db_session:
+        assert SteamMetaData.get(appid=9003)
+
+
+def test_bulk_add_games(catalog):
+    apps = [{"appid": 9100 + i, "name": f"Bulk App {i}"} for i in range(25)]
+    # Dupes, nameless apps and apps we already have are all skipped
+    apps += [{"appid": 9100, "name": "Bulk App 0"}, {"appid": 9200, "name": ""}]
+    assert SteamMetaData.add_games(apps, chunk_size=10) == 25
+    assert SteamMetaData.add_games(apps, chunk_size=10) == 0
+    with db_session:
+        assert SteamMetaData.get(appid=9124).name == "Bulk App 24"
+        assert not SteamMetaData.get(appid=9200)
+
+
+def test_bulk_add_renames(catalog):
+    SteamMetaData.add_games([{"appid": 9250, "name": "Qwvut Early Access"}])
+    # Incremental syncs send apps whose name changed, the row and its search entry follow
+    assert SteamMetaData.add_games([{"appid": 9250, "name": "Qwvut Full Release"}]) == 0
+    with db_session:
+        assert SteamMetaData.get(appid=9250).name == "Qwvut Full Release"
+    assert SteamMetaData.search("qwvut") == ["Qwvut Full Release"]
+    assert "Qwvut Full Release" in steam_names.exact("qwvut full release")
+
+
+def test_search_table(catalog):
+    SteamMetaData.add_games([{"appid": 9301, "name": "Zyxwv Quest: Director's Cut"}])
+    with db_session:
+        SteamMetaData(appid=9302, name="Return to Zyxwv")
+
+    # Rows from both the bulk ingest and the orm are searchable, by any word or the start of one
+    assert SteamMetaData.search("quest zyxwv") == ["Zyxwv Quest: Director's Cut"]
+    assert sorted(SteamMetaData.search("zyx")) == ["Return to Zyxwv", "Zyxwv Quest: Director's Cut"]
+    assert SteamMetaData.search("zyxwv", prefix=True) == ["Zyxwv Quest: Director's Cut"]
+    assert SteamMetaData.search("!!") == []
+
+    with db_session:
+        SteamMetaData.get(appid=9302).delete()
+    assert SteamMetaData.search("return zyxwv") == []
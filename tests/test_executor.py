@@ -0,0 +1,42 @@
+import asyncio
+import threading
+import time
+import pytest
+from executor import DatabaseExecutor
+from orm import Player, db_session, init_database
+
+
+@pytest.mark.asyncio
+async def test_database_executor():
+    init_database()
+    db = DatabaseExecutor()
+
+    @db_session
+    def add_player(id: str) -> str:
+        Player(id=id, name="executor")
+        return threading.current_thread().name
+
+    thread = await db.run(add_player, "7001")
+    assert thread != threading.current_thread().name
+    # Writes from the database thread are visible everywhere else
+    with db_session:
+        assert Player.get(id="7001")
+
+    # Calls run one at a time, so the queue builds up behind a slow one
+    order = []
+
+    def slow(i: int):
+        time.sleep(0.05)
+        order.append(i)
+
+    calls = [asyncio.ensure_future(db.run(slow, i)) for i in range(3)]
+    await asyncio.sleep(0.01)
+    assert db.stats()["pending"] == 3
+    await asyncio.gather(*calls)
+    assert order == [0, 1, 2]
+
+    stats = db.stats()
+    assert stats["pending"] == 0
+    assert stats["calls"] == 4
+    assert stats["wait_max"] >= 0.05
+    db.close()
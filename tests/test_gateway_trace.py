@@ -0,0 +1,46 @@
+import json
+
+from gateway_trace import TraceRecorder, read_trace
+
+
+def test_record_anonymizes(tmp_path):
+    path = str(tmp_path / "trace.jsonl.gz")
+    recorder = TraceRecorder(path)
+    user = {"id": "987654321", "username": "realname", "avatar": "abc"}
+    message = {
+        "id": "555",
+        "channel_id": "444",
+        "guild_id": "333",
+        "author": user,
+        "content": "$add Secret Game <@987654321>",
+        "timestamp": "2024-01-01T00:00:00+00:00",
+    }
+    recorder.record(json.dumps({"t": "MESSAGE_CREATE", "d": message}))
+    recorder.record(json.dumps({"t": "MESSAGE_CREATE", "d": {**message, "content": "hello there"}}))
+    recorder.record(json.dumps({"t": "MESSAGE_CREATE", "d": {**message, "content": "$link 76561198000000001"}}))
+    # The bot's own replies and events we don't replay are left out
+    recorder.record(json.dumps({"t": "MESSAGE_CREATE", "d": {**message, "author": {**user, "bot": True}}}))
+    recorder.record(json.dumps({"t": "TYPING_START", "d": {"user_id": "987654321"}}))
+    presence = {
+        "user": {"id": "987654321"},
+        "guild_id": "333",
+        "status": "online",
+        "activities": [{"type": 0, "name": "Some Game", "details": "In a match", "state": "Ranked"}],
+    }
+    recorder.record(json.dumps({"t": "PRESENCE_UPDATE", "d": presence}))
+    recorder.close()
+
+    events = list(read_trace(path))
+    assert [event for _, event, _ in events] == ["MESSAGE_CREATE"] * 3 + ["PRESENCE_UPDATE"]
+    command, chat, link, presence = (data for _, _, data in events)
+    user_id = command["author"]["id"]
+    assert user_id != "987654321" and command["author"]["username"] == f"user{user_id}"
+    assert command["content"] == f"$add Secret Game <@{user_id}>"
+    assert chat["content"] == ""
+    # Steam ids and vanity names stay out of the trace
+    assert link["content"] == "$link"
+    # Ids map the same way everywhere, so a member's events still line up
+    assert presence["user"]["id"] == user_id and presence["guild_id"] == command["guild_id"]
+    assert presence["activities"] == [{"type": 0, "name": "Some Game"}]
+    assert "realname" not in str(events) and "987654321" not in str(events)
+    assert "76561198000000001" not in str(events)
@@ -0,0 +1,65 @@
+import pytest
+from executor import DatabaseExecutor
+from library import LibrarySync
+from orm import Player, SteamLink, SteamMetaData, db_session, init_database
+from ownership import ownership
+
+
+class FakeSteam:
+    def __init__(self, owned: list[int]):
+        self.owned = owned
+        self.lookups = []
+
+    async def get_games(self, steamid):
+        return [{"appid": appid} for appid in self.owned]
+
+    async def get_games_by_ids(self, appids, progress=None):
+        self.lookups += appids
+        return {appid: {"name": f"Looked Up {appid}"} for appid in appids if appid != 8699}, [8699]
+
+
+def game_names(player_id: str) -> list[str]:
+    with db_session:
+        return sorted(game.name for game in Player.get(id=player_id).get_games())
+
+
+@pytest.mark.asyncio
+async def test_sync_applies_changes():
+    init_database()
+    SteamMetaData.add_games([{"appid": 8600 + i, "name": f"Library App {i}"} for i in range(1, 4)])
+    api = FakeSteam([8601, 8602])
+    libraries = LibrarySync(api, DatabaseExecutor(), interval=0)
+
+    assert await libraries.apply("8600", "syncer", "steam8600", api.owned, api.owned) == (2, [])
+    assert game_names("8600") == ["Library App 1", "Library App 2"]
+
+    # Only what changed is applied, and apps missing from the catalog are looked up
+    api.owned = [8602, 8603, 8698, 8699]
+    assert await libraries.sync_due() == 1
+    assert api.lookups == [8698, 8699]
+    assert game_names("8600") == ["Library App 2", "Library App 3", "Looked Up 8698"]
+    assert not ownership.has_game("8600", "Library App 1")
+    # The failed lookup isn't remembered, so the next sync tries it again
+    assert await libraries.db.run(SteamLink.get_appids, "8600") == [8602, 8603, 8698]
+
+    # A library we can't see isn't taken to mean every game is gone
+    api.owned = []
+    assert await libraries.sync("8600", "steam8600") is None
+    assert game_names("8600") == ["Library App 2", "Library App 3", "Looked Up 8698"]
+
+
+@pytest.mark.asyncio
+async def test_sync_due_in_batches():
+    init_database()
+    libraries = LibrarySync(FakeSteam([]), DatabaseExecutor(), interval=3600, batch_size=2, spacing=0)
+    for i in range(3):
+        await libraries.db.run(SteamLink.update, f"861{i}", "batched", f"steam861{i}", [], [], [])
+
+    # Nothing is due until the interval has passed
+    assert await libraries.sync_due() == 0
+    libraries.interval = 0
+    due = await libraries.db.run(SteamLink.due, float("inf"), 100)
+    assert due.index(("8610", "steam8610")) < due.index(("8611", "steam8611")) < due.index(("8612", "steam8612"))
+    # Each batch picks up the links synced longest ago
+    assert await libraries.sync_due() == 2
+    assert await libraries.db.run(SteamLink.due, float("inf"), 100) == due[2:] + due[:2]
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler
+
+from logs import BatchingQueueListener, JsonFormatter, RotatingFileHandler
+
+
+def test_queued_rotating_json(tmp_path):
+    path = str(tmp_path / "bot.log")
+    handler = RotatingFileHandler(path, max_bytes=300, backup_count=5)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = BatchingQueueListener(records, handler)
+    listener.start()
+
+    logger = logging.getLogger("test_logs")
+    logger.propagate = False
+    logger.addHandler(QueueHandler(records))
+    for i in range(10):
+        logger.warning("record %d", i)
+    listener.stop()
+    handler.close()
+
+    # Size rollovers in the same day get numbered instead of overwriting each other
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) > 2 and "bot.log" in files
+    lines = []
+    for name in files:
+        with open(tmp_path / name, encoding="utf-8") as f:
+            lines += [json.loads(line) for line in f]
+    assert sorted(entry["message"] for entry in lines) == sorted(f"record {i}" for i in range(10))
+    assert lines[0]["level"] == "WARNING" and lines[0]["logger"] == "test_logs"
+
+
+def test_backup_count(tmp_path):
+    path = str(tmp_path / "bot.log")
+    handler = RotatingFileHandler(path, max_bytes=200, backup_count=12)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.getLogger("test_logs.backups")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(400):
+        logger.warning("record %d", i)
+    handler.close()
+
+    # Numbered files count towards the backups, and the oldest are the ones deleted, .10 and up included
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 13 and "bot.log" in files
+    kept = []
+    for name in files:
+        with open(tmp_path / name, encoding="utf-8") as f:
+            kept += [int(line.split()[1]) for line in f]
+    assert sorted(kept) == list(range(min(kept), 400))
+
+
+def test_writes_wait_for_flush(tmp_path):
+    path = str(tmp_path / "bot.log")
+    handler = RotatingFileHandler(path, max_bytes=50 * 1024 * 1024)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.getLogger("test_logs.batched")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(10):
+        logger.warning("record %d", i)
+    # Checking the size for a rollover doesn't flush anything
+    assert os.path.getsize(path) == 0
+    handler.flush_batch()
+    assert os.path.getsize(path) > 0
+    handler.close()
@@ -0,0 +1,39 @@
+import pytest
+from executor import DatabaseExecutor
+from metrics import Metrics, metrics
+from orm import Setting, init_database
+
+
+def test_histograms_and_render():
+    registry = Metrics()
+    for seconds in (0.002, 0.003, 0.004, 0.2):
+        registry.observe("command", seconds, command="suggest")
+    with pytest.raises(ValueError):
+        with registry.timer("command", command="add"):
+            raise ValueError()
+    registry.gauge("db", lambda: {"pending": 2})
+
+    (label, calls, p50, p99), _ = registry.summary("command")
+    assert (label, calls) == ("suggest", 4)
+    # Quantiles are the upper bound of their bucket
+    assert p50 == 0.005 and p99 == 0.25
+    assert registry.counter("command_errors", command="add") == 1
+
+    text = registry.render()
+    assert "# TYPE wswp_command_seconds histogram" in text
+    assert 'wswp_command_seconds_bucket{command="suggest",le="0.005"} 3' in text
+    assert 'wswp_command_seconds_bucket{command="suggest",le="+Inf"} 4' in text
+    assert 'wswp_command_seconds_count{command="suggest"} 4' in text
+    assert 'wswp_command_errors_total{command="add"} 1' in text
+    assert "wswp_db_pending 2" in text
+
+
+@pytest.mark.asyncio
+async def test_database_calls_are_measured():
+    init_database()
+    executor = DatabaseExecutor()
+    before = metrics.counter("db_queries", function="Setting.set_value")
+    await executor.run(Setting.set_value, "metrics.test", "1")
+    assert metrics.counter("db_queries", function="Setting.set_value") > before
+    assert any(label == "Setting.set_value" for label, *_ in metrics.summary("db_call"))
+    executor.close()
@@ -0,0 +1,94 @@
+from orm import Game, Player, SteamMetaData, db_session, flush, init_database, query_count, write_count
+
+
+def test_add_games_links_metadata():
+    init_database()
+    SteamMetaData.add_games(
+        [
+            {"appid": 8101, "name": "Linked Once"},
+            {"appid": 8102, "name": "Linked Twice"},
+            {"appid": 8103, "name": "Linked Twice"},
+        ]
+    )
+    with db_session:
+        player = Player(id="8100", name="linker")
+        player.add_games("Linked Once", "Linked Twice", "Not On Steam", "Linked Once")
+        assert sorted(game.name for game in player.get_games()) == ["Linked Once", "Linked Twice", "Not On Steam"]
+        assert Game.get(name="Linked Once").steam_metadata.appid == 8101
+        # A name on more than one app can't be linked without an appid
+        assert Game.get(name="Linked Twice").steam_metadata is None
+        assert Game.get(name="Not On Steam").steam_metadata is None
+
+
+def test_add_games_with_appid():
+    init_database()
+    SteamMetaData.add_games(
+        [
+            {"appid": 8201, "name": "By Appid"},
+            {"appid": 8202, "name": "By Appid Dupe"},
+            {"appid": 8203, "name": "By Appid Dupe"},
+            {"appid": 8204, "name": "By Appid Existing"},
+        ]
+    )
+    with db_session:
+        Game(name="By Appid Existing")
+        player = Player(id="8200", name="linker")
+        # Unknown appids are skipped
+        player.add_games_with_appid(8201, 8202, 8203, 8204, 8299)
+        assert sorted(game.name for game in player.get_games()) == ["By Appid", "By Appid Dupe", "By Appid Existing"]
+        assert Game.get(name="By Appid").steam_metadata.appid == 8201
+        # Games sharing a name end up linked to the last of their apps
+        assert Game.get(name="By Appid Dupe").steam_metadata.appid == 8203
+        # An existing game with the same name gets linked instead of making a new one
+        assert Game.get(name="By Appid Existing").steam_metadata.appid == 8204
+
+
+def test_add_games_statement_count():
+    init_database()
+    SteamMetaData.add_games({"appid": 8500 + i, "name": f"Counted App {i}"} for i in range(200))
+    with db_session:
+        player = Player(id="8500", name="counter")
+        flush()
+        before = query_count()
+        player.add_games_with_appid(*range(8500, 8700))
+        player.add_games(*(f"Counted Name {i}" for i in range(200)))
+        flush()
+        # sqlite counts every row of an executemany. Each new game is a row in the Game insert and one in
+        # the Game_Player insert, and looking them up is a few queries for the lot.
+        assert query_count() - before <= 2 * 400 + 20
+        assert len(player.games) == 400
+        assert Game.get(name="Counted App 7").steam_metadata.appid == 8507
+
+
+def test_add_games_after_rename():
+    init_database()
+    SteamMetaData.add_games([{"appid": 8801, "name": "Before Rename"}])
+    with db_session:
+        Player(id="8800", name="renamer").add_games_with_appid(8801)
+    SteamMetaData.add_games([{"appid": 8801, "name": "After Rename"}])
+    with db_session:
+        Player.get(id="8800").add_games("After Rename")
+    with db_session:
+        # The game under the new name takes the link, the old one keeps its players
+        assert SteamMetaData.get(appid=8801).game.name == "After Rename"
+        assert Game.get(name="Before Rename").steam_metadata is None
+
+
+def test_add_details_skips_known():
+    init_database()
+    SteamMetaData.add_games([{"appid": 8401, "name": "Added Meanwhile"}])
+    # 8401 was added by something else while steam was being asked about it
+    assert SteamMetaData.add_details({8401: {"name": "Added Meanwhile"}, 8402: {"name": "Looked Up"}}) == [8401, 8402]
+    with db_session:
+        assert SteamMetaData.get(appid=8402).name == "Looked Up"
+
+
+def test_write_count():
+    init_database()
+    with db_session:
+        before = write_count()
+        Player.get(id="8900")
+        assert write_count() == before
+        Player(id="8900", name="writer")
+        flush()
+        assert write_count() == before + 1
@@ -0,0 +1,80 @@
+import random
+from orm import Game, Player, db_session, init_database, load_ownership
+from ownership import OwnershipIndex, bits, mask, ownership
+
+
+def test_mask():
+    assert mask([]) == 0
+    assert mask([0, 3, 64, 3]) == (1 << 0) | (1 << 3) | (1 << 64)
+    assert list(bits(mask([70, 1, 5]))) == [1, 5, 70]
+
+
+def test_suggest_matches_sets():
+    rng = random.Random(0)
+    names = [f"Game {i}" for i in range(300)]
+    libraries = {str(i): set(rng.sample(names, 120)) for i in range(50)}
+    bans = {str(i): set(rng.sample(names, 5)) for i in range(50)}
+    counts = {name: rng.randint(1, 8) for name in rng.sample(names, 100)}
+
+    index = OwnershipIndex()
+    index.build(
+        [(player, name) for player, games in libraries.items() for name in games],
+        [(player, name) for player, games in bans.items() for name in games],
+        counts.items(),
+    )
+    for _ in range(50):
+        players = rng.sample(sorted(libraries), rng.randint(1, 3))
+        player_count = rng.randint(1, 8)
+        shared = set.intersection(*(libraries[p] for p in players))
+        banned = set.union(*(bans[p] for p in players))
+        expected = {name for name in shared if counts.get(name, player_count) >= player_count}
+        assert set(index.suggest(players, player_count, ignore_bans=True)) == expected
+        assert set(index.suggest(players, player_count)) == expected - banned
+
+    index.remove_games("0", *libraries["0"])
+    assert index.suggest(["0"], 1) == []
+    assert index.suggest(["unknown"], 1) == []
+
+
+def test_orm_keeps_ownership_current():
+    init_database()
+    with db_session:
+        player = Player(id="9001", name="owner")
+        player.add_games("Owned A", "Owned B", "Owned C")
+        player.add_banned_games("Owned C")
+        player.remove_games("Owned B")
+        Game.get(name="Owned A").player_count = 4
+    assert ownership.suggest(["9001"], 2) == ["Owned A"]
+    assert ownership.suggest(["9001"], 5) == []
+    assert ownership.suggest(["9001"], 5, ignore_bans=True) == ["Owned C"]
+
+    # Loading from the database gives the same answers as the incremental updates
+    before = {(p, n): ownership.suggest([p], n) for p in ("9001", "9002") for n in (1, 4, 5)}
+    load_ownership()
+    assert {(p, n): ownership.suggest([p], n) for p in ("9001", "9002") for n in (1, 4, 5)} == before
+
+
+def test_suggest_cache():
+    index = OwnershipIndex()
+    index.build([("1", "A"), ("1", "B"), ("2", "A"), ("2", "B"), ("3", "C")], [], [])
+    assert index.suggest(["1", "2"], 2) == ["A", "B"]
+    assert index.suggest(["2", "1"], 2) == ["A", "B"]
+    assert index.cache_stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    # Changes to players outside the group, or games the group doesn't share, keep the result
+    index.add_games("3", "A")
+    index.set_player_count("C", 1)
+    # So does adding a game someone already has
+    index.add_games("1", "A")
+    assert index.suggest(["1", "2"], 2) == ["A", "B"]
+    assert index.hits == 2
+
+    # Anything that changes the answer drops it
+    index.add_bans("2", "A")
+    assert index.suggest(["1", "2"], 2) == ["B"]
+    index.set_player_count("B", 1)
+    assert index.suggest(["1", "2"], 2) == []
+    index.remove_games("1", "B")
+    index.set_player_count("B", None)
+    assert index.suggest(["1", "2"], 2, ignore_bans=True) == ["A"]
+    assert index.hits == 2
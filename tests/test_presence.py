@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import discord
+import pytest
+from executor import DatabaseExecutor
+from orm import Player, db_session, init_database
+from presence import PresenceBuffer, PresenceIndex
+
+
+def library(id: str) -> list[str]:
+    with db_session:
+        player = Player.get(id=id)
+        return sorted(game.name for game in player.get_games()) if player else []
+
+
+@pytest.mark.asyncio
+async def test_presence_buffer():
+    init_database()
+    db = DatabaseExecutor()
+    buffer = PresenceBuffer(db, max_size=100)
+
+    # Repeats are only written once, and nothing is written until the flush
+    for _ in range(3):
+        buffer.add("6001", "presence", "Seen Game 1")
+        buffer.add("6001", "presence", "Seen Game 2")
+        buffer.add("6002", "presence", "Seen Game 1")
+    assert len(buffer) == 3
+    assert library("6001") == []
+
+    assert await buffer.flush() == 3
+    assert library("6001") == ["Seen Game 1", "Seen Game 2"]
+    assert library("6002") == ["Seen Game 1"]
+
+    # Games the player already has never make it into the buffer
+    buffer.add("6001", "presence", "Seen Game 1")
+    assert len(buffer) == 0
+    assert await buffer.flush() == 0
+
+    # Closing writes whatever is left
+    buffer.add("6002", "presence", "Seen Game 3")
+    await buffer.close()
+    assert library("6002") == ["Seen Game 1", "Seen Game 3"]
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_presence_buffer_flushes_when_full():
+    init_database()
+    db = DatabaseExecutor()
+    buffer = PresenceBuffer(db, max_size=5)
+    for i in range(5):
+        buffer.add("6003", "presence", f"Full Game {i}")
+    # The flush starts in the background as soon as it's full
+    await asyncio.sleep(0)
+    assert len(buffer) == 0
+    await buffer.close()
+    assert len(library("6003")) == 5
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_presence_buffer_close_during_flush():
+    init_database()
+    db = DatabaseExecutor()
+    buffer = PresenceBuffer(db)
+    # Keeps the database thread busy, so the loop's write is still queued when it's cancelled
+    busy = threading.Event()
+    blocked = asyncio.ensure_future(db.run(busy.wait))
+    buffer.add("6004", "presence", "Queued Game")
+    buffer.start()
+    await asyncio.sleep(0.01)
+    assert len(buffer) == 0
+    asyncio.get_running_loop().call_later(0.01, busy.set)
+    await buffer.close()
+    await blocked
+    assert library("6004") == ["Queued Game"]
+    db.close()
+
+
+def test_presence_index():
+    online, idle = discord.Status.online, discord.Status.idle
+    general = SimpleNamespace(id=10, members=[])
+    guild = SimpleNamespace(id=1, members=[], voice_channels=[general])
+
+    def member(id: int, status: discord.Status) -> SimpleNamespace:
+        m = SimpleNamespace(id=id, status=status, guild=guild)
+        guild.members.append(m)
+        return m
+
+    m1, m2, bot = member(1, online), member(2, idle), member(99, online)
+    general.members.append(m1)
+    index = PresenceIndex(ignore=[99])
+    assert index.online(guild) == {1}
+    assert index.in_channel(guild, 10) == {1}
+
+    # Events keep the loaded guild current without going back to the member list
+    guild.members.clear()
+    m2.status = online
+    index.update_status(m2)
+    index.update_status(bot)
+    assert index.online(guild) == {1, 2}
+    index.update_voice(m2, None, general)
+    index.update_voice(m1, general, None)
+    assert index.in_channel(guild, 10) == {2}
+    index.remove_member(m2)
+    assert index.online(guild) == {1}
+    assert index.in_channel(guild, 10) == set()
+
+    # Forgetting the guild means it's loaded again next time
+    index.remove_guild(guild)
+    assert index.online(guild) == set()
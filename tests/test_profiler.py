@@ -0,0 +1,42 @@
+import os
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+from profiler import Profiler
+
+
+async def on_thing(count: int):
+    return sorted(range(count), reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_profile_listener(tmp_path):
+    bot = SimpleNamespace(extra_events={"on_thing": [on_thing]}, get_command=lambda name: None)
+    profiler = Profiler(bot, directory=str(tmp_path))
+    assert not profiler.enable("missing")
+
+    assert profiler.enable("thing")
+    assert profiler.targets == ["on_thing"] and tracemalloc.is_tracing()
+    assert await bot.extra_events["on_thing"][0](1000) == list(range(999, -1, -1))
+    assert "on_thing" in profiler.last_report and "sorted" in profiler.last_report
+    assert sorted(os.path.splitext(name)[1] for name in os.listdir(tmp_path)) == [".prof", ".txt"]
+    # Busy listeners are sampled, the next run within the interval isn't profiled
+    await bot.extra_events["on_thing"][0](10)
+    assert len(os.listdir(tmp_path)) == 2
+
+    # Turning it off puts the listener back as it was
+    profiler.disable()
+    assert bot.extra_events["on_thing"] == [on_thing]
+    assert not profiler.targets and not tracemalloc.is_tracing()
+
+
+def test_one_run_at_a_time(tmp_path):
+    profiler = Profiler(SimpleNamespace(), directory=str(tmp_path))
+    session = profiler.start("suggest")
+    # cProfile can't nest, so anything else running at the same time isn't profiled
+    assert profiler.start("add") is None
+    profiler.finish(session)
+    session = profiler.start("add")
+    assert session is not None
+    profiler.finish(session)
@@ -0,0 +1,67 @@
+import random
+from search import NameIndex, TrigramIndex, rank
+
+NAMES = [
+    "Portal",
+    "Portal 2",
+    "portal",
+    "Half-Life 2: Episode One",
+    "Half-Life 2",
+    "Counter-Strike 2",
+    "Straße Racer",
+    "The Witcher 3",
+    "Witcher",
+    "2",
+]
+
+
+def scan(names: list[str], query: str) -> tuple[set[str], set[str], set[str]]:
+    # What the old lower()/startswith/endswith table scans returned
+    query = query.lower()
+    return (
+        {n for n in names if n.lower() == query},
+        {n for n in names if n.lower().startswith(query)},
+        {n for n in names if n.lower().endswith(query)},
+    )
+
+
+def test_name_index_matches_scan():
+    index = NameIndex()
+    index.build(NAMES)
+    for query in ["portal", "PORTAL 2", "half", "2", "witcher", "STRASSE", "straße", "", "nothing"]:
+        exact, prefix, suffix = scan(NAMES, query)
+        assert set(index.exact(query)) == exact
+        assert set(index.prefix(query)) == prefix
+        assert set(index.suffix(query)) == suffix
+
+
+def test_name_index_incremental_add():
+    names = [f"Game {random.randint(0, 10**6)}" for _ in range(500)]
+    index = NameIndex()
+    # Mix single adds with a bulk add, the result should be the same as building from scratch
+    for name in names[:20]:
+        index.add(name)
+    index.add(*names[20:])
+    index.add(*names[:20])
+    assert len(index) == len(set(names))
+    for query in ["game 1", "7", "game", "00"]:
+        exact, prefix, suffix = scan(names, query)
+        assert set(index.exact(query)) == exact
+        assert set(index.prefix(query)) == prefix
+        assert set(index.suffix(query)) == suffix
+
+
+def test_trigram_search():
+    index = TrigramIndex()
+    index.build(NAMES + ["Helldivers 2", "Hellblade", "Dead Cells"])
+    # Typos and partial titles still find the game
+    assert index.search("Helldiver 2")[0] == "Helldivers 2"
+    assert index.search("half life 2")[0] == "Half-Life 2"
+    assert set(index.search("witcher 3", limit=2)) == {"The Witcher 3", "Witcher"}
+    # Nothing similar enough means nothing is suggested
+    assert index.search("Minecraft", threshold=0.6) == []
+    assert len(index.search("portal", limit=2)) == 2
+
+
+def test_rank():
+    assert rank("portal", ["Portal 2", "Portal", "Half-Life 2"], limit=2) == ["Portal", "Portal 2"]
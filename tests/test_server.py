@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+from cog.server import ServerCog
+from orm import Game, Player, db_session, init_database
+
+
+def test_suggest_game():
+    init_database()
+    with db_session:
+        p1 = Player(id="8001", name="p1")
+        p2 = Player(id="8002", name="p2")
+        p3 = Player(id="8003", name="p3")
+        p1.add_games("Suggest A", "Suggest B", "Suggest C")
+        p2.add_games("Suggest A", "Suggest B")
+        p3.add_games("Suggest A", "Suggest C")
+        p3.add_banned_games("Suggest B")
+
+    bot = SimpleNamespace(_ignore_banlist=False, _MEMBER_IGNORE_LIST=[])
+    cog = ServerCog(bot)
+    assert cog.suggest_game([], 2) is None
+    # Only games everyone has
+    assert cog.suggest_game(["8001", "8002", "8003"], 3) == ["Suggest A"]
+    assert sorted(cog.suggest_game(["8001", "8002"], 2)) == ["Suggest A", "Suggest B"]
+    # Members we know nothing about don't have anything
+    assert cog.suggest_game(["8001", "8999"], 2) is None
+
+    # A ban from anyone online keeps the game out, unless bans are ignored
+    with db_session:
+        p3 = Player.get(id="8003")
+        p3.add_banned_games("Suggest C")
+    assert cog.suggest_game(["8001", "8003"], 2) == ["Suggest A"]
+    bot._ignore_banlist = True
+    assert sorted(cog.suggest_game(["8001", "8003"], 2)) == ["Suggest A", "Suggest C"]
+    bot._ignore_banlist = False
+
+    # Games that don't support enough players are left out
+    with db_session:
+        Game.get(name="Suggest A").player_count = 2
+    assert cog.suggest_game(["8001", "8002"], 3) == ["Suggest B"]
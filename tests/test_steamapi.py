@@ -0,0 +1,175 @@
+import json
+import pytest_asyncio
+import pytest
+import time
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from steamapi import AppListParser, SteamAPI, SteamAPIError, TokenBucket
+
+
+def fake_steam_app(hits: dict[str, int]) -> web.Application:
+    """A tiny stand-in for the steam web api, with a flaky endpoint to exercise retries."""
+    app = web.Application()
+
+    def hit(request: web.Request) -> int:
+        hits[request.path] = hits.get(request.path, 0) + 1
+        return hits[request.path]
+
+    async def owned_games(request: web.Request):
+        hit(request)
+        if request.query["steamid"] == "private":
+            return web.json_response({"response": {}})
+        return web.json_response({"response": {"game_count": 2, "games": [{"appid": 10}, {"appid": 20}]}})
+
+    async def vanity(request: web.Request):
+        hit(request)
+        return web.json_response({"response": {"steamid": "7656", "success": 1}})
+
+    async def app_list(request: web.Request):
+        # Fail the first call so the client has to retry
+        if hit(request) == 1:
+            return web.Response(status=503)
+        return web.json_response(
+            {"applist": {"apps": [{"appid": 10, "name": "Game1"}, {"appid": 20, "name": "Game2"}]}}
+        )
+
+    async def truncated_app_list(request: web.Request):
+        hit(request)
+        return web.Response(body=b'{"applist": {"apps": [{"appid": 10, "name": "Game1"}, {"appid": 2')
+
+    async def app_details(request: web.Request):
+        hit(request)
+        appid = request.query["appids"]
+        if appid == "404":
+            return web.Response(status=404)
+        if appid == "0":
+            return web.json_response({appid: {"success": False}})
+        data = {"name": f"Game {appid}", "detailed_description": "Long text", "screenshots": [{"id": 0}]}
+        return web.json_response({appid: {"success": True, "data": data}})
+
+    app.router.add_get("/IPlayerService/GetOwnedGames/v0001/", owned_games)
+    app.router.add_get("/ISteamUser/ResolveVanityURL/v0001/", vanity)
+    app.router.add_get("/ISteamApps/GetAppList/v2/", app_list)
+    app.router.add_get("/truncated/ISteamApps/GetAppList/v2/", truncated_app_list)
+    app.router.add_get("/api/appdetails", app_details)
+    return app
+
+
+@pytest_asyncio.fixture
+async def steam():
+    hits = {}
+    server = TestServer(fake_steam_app(hits))
+    await server.start_server()
+    url = str(server.make_url(""))
+    api = SteamAPI("KEY", api_url=url, store_url=url, backoff=0)
+
+    yield api, hits
+
+    await api.close()
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_get_games(steam):
+    api, _ = steam
+    assert await api.get_games("7656") == [{"appid": 10}, {"appid": 20}]
+    assert await api.get_games("private") == []
+    assert await api.get_steam_id("somokai") == "7656"
+
+
+@pytest.mark.asyncio
+async def test_retry_and_pooling(steam):
+    api, hits = steam
+    apps = await api.get_app_list()
+    assert [a["name"] for a in apps] == ["Game1", "Game2"]
+    assert hits["/ISteamApps/GetAppList/v2/"] == 2
+
+    # All requests share the same pooled session
+    session = api.session()
+    await api.get_games_by_id(10)
+    assert api.session() is session
+
+
+@pytest.mark.asyncio
+async def test_get_games_by_id(steam):
+    api, hits = steam
+    assert await api.get_games_by_id(10) == {"name": "Game 10"}
+    assert await api.get_games_by_id(0) == []
+    # Non-retryable errors give up right away
+    assert await api.get_games_by_id(404) == []
+    assert hits["/api/appdetails"] == 3
+
+
+@pytest.mark.asyncio
+async def test_get_games_by_ids(steam):
+    api, hits = steam
+    updates = []
+
+    async def progress(done: int, total: int):
+        updates.append((done, total))
+
+    resolved, failed = await api.get_games_by_ids([10, 0, 20, 404], concurrency=2, progress=progress)
+    assert resolved == {10: {"name": "Game 10"}, 20: {"name": "Game 20"}}
+    assert sorted(failed) == [0, 404]
+    assert updates[-1] == (4, 4)
+    assert hits["/api/appdetails"] == 4
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=2)
+    start = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # Two tokens are free, the other two have to wait for the refill
+    assert time.monotonic() - start >= 0.015
+
+
+class DictCache(dict):
+    def set(self, key, value, ttl):
+        self[key] = value
+
+
+@pytest.mark.asyncio
+async def test_cached_lookups(steam):
+    api, hits = steam
+    api.cache = DictCache()
+    for _ in range(2):
+        assert await api.get_games("7656") == [{"appid": 10}, {"appid": 20}]
+        assert await api.get_games("private") == []
+        assert await api.get_games_by_id(42) == {"name": "Game 42"}
+        assert await api.get_games_by_id(0) == []
+    # Every lookup went to steam once, even unknown apps, but empty libraries are asked for again
+    assert hits["/IPlayerService/GetOwnedGames/v0001/"] == 3
+    assert hits["/api/appdetails"] == 2
+    # $link always gets the library as it is now
+    assert await api.get_games("7656", fresh=True) == [{"appid": 10}, {"appid": 20}]
+    assert hits["/IPlayerService/GetOwnedGames/v0001/"] == 4
+
+
+def test_app_list_parser():
+    apps = [{"appid": i, "name": f"Gäme ★ {i}"} for i in range(50)]
+    body = json.dumps({"applist": {"apps": apps}}, ensure_ascii=False, indent=1).encode()
+    # Pieces that split objects, keys and multi-byte characters all still parse
+    for size in (1, 7, 64, len(body)):
+        parser = AppListParser()
+        parsed = []
+        for i in range(0, len(body), size):
+            parsed += parser.feed(body[i : i + size])
+        assert parsed == apps
+        assert parser.done
+
+
+@pytest.mark.asyncio
+async def test_app_list_chunks(steam):
+    api, hits = steam
+    chunks = [chunk async for chunk in api.get_app_list_chunks(chunk_size=1)]
+    assert chunks == [[{"appid": 10, "name": "Game1"}], [{"appid": 20, "name": "Game2"}]]
+
+    # A body that stops partway gives up what it had, then fails
+    api.api_url += "/truncated"
+    chunks = []
+    with pytest.raises(SteamAPIError):
+        async for chunk in api.get_app_list_chunks():
+            chunks.append(chunk)
+    assert chunks == [[{"appid": 10, "name": "Game1"}]]
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+import pytest
+from executor import DatabaseExecutor
+from orm import SteamCache, db_session, init_database
+from steamcache import ResponseCache
+
+
+@pytest.fixture
+def db():
+    init_database()
+    with db_session:
+        SteamCache.select().delete(bulk=True)
+    db = DatabaseExecutor()
+    yield db
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_response_cache(db):
+    cache = ResponseCache(db, max_size=3)
+    cache.set("a", {"name": "A"}, ttl=60)
+    cache.set("b", [], ttl=60)
+    cache.set("gone", [1], ttl=-1)
+    assert cache.get("a") == {"name": "A"}
+    # Empty values are still hits, that's how failed lookups are remembered
+    assert cache.get("b") == []
+    assert cache.get("gone") is None
+    assert cache.get("missing") is None
+
+    # Past the size cap the least recently used go first
+    cache.set("c", 3, ttl=60)
+    assert cache.get("a") == {"name": "A"}
+    cache.set("d", 4, ttl=60)
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 3, "misses": 3, "hit_rate": 0.5, "size": 3}
+
+    # Saved entries come back after a restart
+    await cache.close()
+    restarted = ResponseCache(db, max_size=3)
+    restarted.load()
+    assert len(restarted) == 3
+    assert restarted.get("a") == {"name": "A"}
+    assert restarted.get("b") is None
+
+
+@pytest.mark.asyncio
+async def test_load_keeps_longest_lived(db):
+    cache = ResponseCache(db)
+    for i in range(5):
+        cache.set(str(i), i, ttl=60 + i)
+    await cache.flush()
+    small = ResponseCache(db, max_size=2)
+    small.load()
+    assert [small.get(str(i)) for i in range(5)] == [None, None, None, 3, 4]
+    with db_session:
+        assert SteamCache.get(key="4").expires > time.time()
+
+
+@pytest.mark.asyncio
+async def test_close_during_flush(db):
+    cache = ResponseCache(db)
+    # Keeps the database thread busy, so the loop's save is still queued when it's cancelled
+    busy = threading.Event()
+    blocked = asyncio.ensure_future(db.run(busy.wait))
+    cache.set("queued", {"name": "Queued"}, ttl=60)
+    cache.start()
+    await asyncio.sleep(0.01)
+    asyncio.get_running_loop().call_later(0.01, busy.set)
+    await cache.close()
+    await blocked
+    with db_session:
+        assert SteamCache.get(key="queued")
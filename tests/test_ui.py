@@ -0,0 +1,55 @@
+import pytest
+from cog.ui import GamePages, WhichGames
+from executor import DatabaseExecutor
+from orm import Player, db_session, init_database
+
+
+@pytest.mark.asyncio
+async def test_game_pages():
+    init_database()
+    names = [f"Paged Game {i:03}" for i in range(95)]
+    with db_session:
+        player = Player(id="8400", name="pager")
+        player.add_games(*reversed(names))
+        player.add_banned_games("Paged Game 000")
+
+    db = DatabaseExecutor()
+    pages = GamePages(db, "8400")
+    await pages.load()
+    assert pages.count == 95
+    assert pages.max_page == 10
+
+    # Pages count from 1 and come back sorted, padded for the embed
+    first = await pages.get(1)
+    assert [row.strip() for row in first] == names[:10]
+    assert all(len(row) == 50 for row in first)
+    assert [row.strip() for row in await pages.get(10)] == names[90:]
+
+    # The next page was read along with the first, so it doesn't go back to the database
+    calls = db.calls
+    assert [row.strip() for row in await pages.get(2)] == names[10:20]
+    assert db.calls == calls
+
+    # Only a few pages are kept
+    for page in range(1, 11):
+        await pages.get(page)
+    assert len(pages._pages) <= GamePages.CACHE_SIZE
+
+    bans = GamePages(db, "8400", banned=True)
+    await bans.load()
+    assert [row.strip() for row in await bans.get(1)] == ["Paged Game 000"]
+
+    nobody = GamePages(db, "8499")
+    await nobody.load()
+    assert nobody.max_page == 1
+    assert await nobody.get(1) == []
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_which_games_fits_discord():
+    # Discord rejects dropdowns with more than 25 options, the two extra ones included
+    view = WhichGames(1, {"picked": [f"Candidate {i}" for i in range(25)], "other": ["Only One"]})
+    for row in view.to_components():
+        for component in row["components"]:
+            assert len(component["options"]) <= 25
@@ -0,0 +1,28 @@
+from cog.user import UserCog
+from cog.ui import WhichGames
+from orm import Player, SteamMetaData, db_session, init_database, load_name_indexes
+
+
+def test_find_games():
+    init_database()
+    SteamMetaData.add_games([{"appid": 8301, "name": "Findable Quest"}, {"appid": 8302, "name": "Findable Quest 2"}])
+    with db_session:
+        Player(id="8300", name="finder").add_games("Findable Local")
+    load_name_indexes()
+
+    found = UserCog(None).find_games(["Findable Local", "Findable Quest", "findable local", "Findable Q", "Unfindable"])
+    # Exact names are used as they are, anything close needs picking from a list
+    assert found["Findable Local"] == "Findable Local"
+    assert found["Findable Quest"] == "Findable Quest"
+    assert found["findable local"] == ["Findable Local"]
+    assert found["Findable Q"] == ["Findable Quest", "Findable Quest 2"]
+    # Nothing like it at all
+    assert found["Unfindable"] is None
+
+
+def test_find_games_fits_dropdown():
+    init_database()
+    SteamMetaData.add_games([{"appid": 8310 + i, "name": f"Crowded Prefix {i}"} for i in range(30)])
+    load_name_indexes()
+    # Room is left in the dropdown for "None of These" and "Add Game"
+    assert len(UserCog(None).find_games(["Crowded Pre"])["Crowded Pre"]) == WhichGames.MAX_CHOICES
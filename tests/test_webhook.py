@@ -1,8 +1,9 @@
+import asyncio
 import pytest_asyncio
 import pytest
 from main import WhatShouldWePlayBot, UserCog, ServerCog
 from orm import Player, Game, db_session
-from discord.ext import test
+from discord.ext import commands, test
 import os
 import discord
 
@@ -137,3 +138,35 @@ async def test_suggest(bot):
     await test.message("$suggest 3", member=m1)
     resp = test.get_message()
     assert resp.content == "Game1"
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failure_still_syncs(bot):
+    async def fail():
+        raise RuntimeError("steam is down")
+
+    bot.sync_with_steam = fail
+    await bot.warm_up()
+    # The failure is logged and the periodic sync takes over
+    assert not bot.warming_up and bot.catalog._task.is_running()
+    bot.catalog.stop()
+
+
+@pytest.mark.asyncio
+async def test_guild_available_reloads_presence(bot):
+    guild = bot.guilds[0]
+    presence = bot.get_cog("ServerCog").presence
+    presence.online(guild)
+    assert guild.id in presence._status
+    # A reconnect that can't resume sends the guild again, without the presence updates in between
+    bot.dispatch("guild_available", guild)
+    await asyncio.sleep(0)
+    assert guild.id not in presence._status
+
+
+@pytest.mark.asyncio
+async def test_profile_needs_admin(bot):
+    member = await test.member_join()
+    with pytest.raises(commands.MissingPermissions):
+        await test.message("$admin profile on suggest", member=member)
+    assert not bot.profiler.targets